@@ -0,0 +1,206 @@
+import argparse
+import importlib.metadata
+import itertools
+import json
+import multiprocessing
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from core.config import INITIAL_VISION_RANGE, SimulationConfig
+from app.startup import add_arguments as add_startup_arguments
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _int_list(text: str) -> list:
+    return [int(v) for v in text.split(",")]
+
+
+def _float_list(text: str) -> list:
+    return [float(v) for v in text.split(",")]
+
+
+def case_name(case: dict) -> str:
+    return f"creatures={case['creatures']} food={case['food']} vision={case['vision']:g}"
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _timed(fn, sync) -> float:
+    start = time.perf_counter()
+    fn()
+    sync()
+    return time.perf_counter() - start
+
+
+def run_case(case: dict, base: SimulationConfig, startup: dict, ticks: int, warmup: int, render: bool) -> dict:
+    # Startup covers what a fresh process pays before its first tick: the
+    # Taichi import, ti.init and building and initialising the simulation,
+    # with kernels loaded from the offline cache when it is enabled.
+    started = time.perf_counter()
+    import taichi as ti
+    from app.startup import init_taichi
+    from core.events import EventManager
+    from core.renderer import Renderer
+    from core.simulation import Simulation
+
+    config = replace(
+        base,
+        initial_creatures=case["creatures"],
+        max_creatures=max(base.max_creatures, 2 * case["creatures"]),
+        initial_food=case["food"],
+        max_food=case["food"],
+        # The config must cover the initial vision range; every creature's
+        # range is set to the case's value after initialisation.
+        max_vision_range=max(case["vision"], INITIAL_VISION_RANGE[1]),
+    )
+    init_seconds = init_taichi(startup["arch"], config.seed, startup["threads"], startup["cache_dir"],
+                               log_level=ti.WARN)
+
+    simulation = Simulation(EventManager(), config)
+    renderer = Renderer(simulation) if render else None
+    simulation.initialize()
+    simulation.creatures.vision_range.fill(case["vision"])
+    ti.sync()
+    startup_seconds = time.perf_counter() - started
+
+    # One sample per kernel launch, spread over the ticks it fused.
+    fused = config.ticks_per_launch
+
+    def tick():
+        simulation.step(fused)
+
+    # The first launch of each kernel includes JIT compilation; the following
+    # warm-up ticks let the population and caches settle before timing.
+    result = {**case, "startup_seconds": startup_seconds, "init_seconds": init_seconds,
+              "compile_seconds": _timed(tick, ti.sync)}
+    if render:
+        result["render_compile_seconds"] = _timed(renderer.render_scene, ti.sync)
+
+    start = time.perf_counter()
+    for _ in range(warmup // fused):
+        tick()
+    ti.sync()
+    result["warmup_seconds"] = time.perf_counter() - start
+    result["population_start"] = int(simulation.total_alive.to_numpy().sum())
+
+    tick_times = [_timed(tick, ti.sync) / fused for _ in range(max(1, ticks // fused))]
+    result["population_end"] = int(simulation.total_alive.to_numpy().sum())
+    result["ticks_per_second"] = len(tick_times) / sum(tick_times)
+    result["tick_p50_ms"] = _percentile(tick_times, 0.50) * 1000
+    result["tick_p99_ms"] = _percentile(tick_times, 0.99) * 1000
+
+    if render:
+        frame_times = [_timed(renderer.render_scene, ti.sync) for _ in range(max(1, ticks // 10))]
+        result["frame_p50_ms"] = _percentile(frame_times, 0.50) * 1000
+        result["frame_p99_ms"] = _percentile(frame_times, 0.99) * 1000
+
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def run_matrix(cases: list, base: SimulationConfig, startup: dict, ticks: int, warmup: int, render: bool) -> dict:
+    # One fresh process per case, so compile time and peak memory are not
+    # shared with the cases that ran before it.
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_case, case, base, startup, ticks, warmup, render).result()
+        results.append(result)
+        frame = f" frame p50 {result['frame_p50_ms']:.2f}ms" if render else ""
+        print(f"{case_name(case)}: {result['ticks_per_second']:.0f} ticks/s, "
+              f"p50 {result['tick_p50_ms']:.2f}ms p99 {result['tick_p99_ms']:.2f}ms{frame}, "
+              f"startup {result['startup_seconds']:.2f}s + compile {result['compile_seconds']:.2f}s")
+
+    return {
+        "meta": {
+            "taichi": importlib.metadata.version("taichi"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **startup,
+            "ticks": ticks,
+            "warmup": warmup,
+            "config": base.to_dict(),
+        },
+        "cases": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    previous = {case_name(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        name = case_name(case)
+        if name not in previous:
+            print(f"{name}: not in baseline")
+            continue
+        change = case["ticks_per_second"] / previous[name]["ticks_per_second"] - 1
+        p99_change = case["tick_p99_ms"] / previous[name]["tick_p99_ms"] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        startup = ""
+        if "startup_seconds" in previous[name]:
+            startup = f", startup {case['startup_seconds'] / previous[name]['startup_seconds'] - 1:+.1%}"
+        print(f"{name}: ticks/s {change:+.1%}, p99 {p99_change:+.1%}{startup}{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark simulation ticks and frame rendering headlessly.")
+    parser.add_argument("--creatures", type=_int_list, default=[500, 2000, 8000],
+                        help="comma-separated initial creature counts")
+    parser.add_argument("--food", type=_int_list, default=[200, 2000], help="comma-separated food counts")
+    parser.add_argument("--vision", type=_float_list, default=[75.0, 150.0],
+                        help="comma-separated creature vision ranges")
+    parser.add_argument("--ticks", type=int, default=300, help="timed ticks per case")
+    parser.add_argument("--warmup", type=int, default=50, help="untimed ticks after compilation")
+    parser.add_argument("--no-render", dest="render", action="store_false", help="skip timing Renderer.render_scene")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional ticks/s drop against the baseline reported as a regression")
+    add_startup_arguments(parser)
+    SimulationConfig.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base = SimulationConfig.from_args(args)
+    cases = [
+        {"creatures": c, "food": f, "vision": v}
+        for c, f, v in itertools.product(args.creatures, args.food, args.vision)
+    ]
+
+    startup = {"arch": args.arch, "threads": args.threads, "cache_dir": args.cache_dir}
+    results = run_matrix(cases, base, startup, args.ticks, args.warmup, args.render)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {len(cases)} cases -> {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import taichi as ti
+from core.capture import FrameCapture, FORMATS
+from core.checkpoint import read_checkpoint, write_checkpoint
+from core.config import SimulationConfig
+from core.simulation import Simulation, world_seed
+from core.events import EventManager
+from core.profiler import Profiler
+from core.stats import PopulationStats, StatsWriter
+from app.startup import DEFAULT_CACHE_DIR, add_arguments as add_startup_arguments, init_taichi, warm_cache
+
+
+class HeadlessApplication:
+    def __init__(self, config: SimulationConfig = None, arch: str = "cpu", profile: bool = False,
+                 trace_path: str = None, threads: int = 0, cache_dir: str = DEFAULT_CACHE_DIR,
+                 rng_seed: int = None):
+        self.config = config or SimulationConfig()
+        rng_seed = self.config.seed if rng_seed is None else rng_seed
+        self.init_seconds = init_taichi(arch, rng_seed, threads, cache_dir, kernel_profiler=profile)
+
+        self.event_manager = EventManager()
+        self.simulation = Simulation(self.event_manager, self.config)
+
+        self.profiler = Profiler(kernel_profiler=True) if profile else None
+        self.simulation.profiler = self.profiler
+        self.trace_path = trace_path
+
+        # (interval, callback) pairs; stepping stops on every multiple of an
+        # interval and calls the callback, so tasks cost nothing in between.
+        self.periodic = []
+        self.on_finish = []
+
+    def add_periodic(self, every: int, callback):
+        self.periodic.append((every, callback))
+
+    def enable_stats(self, every: int, path: str, bins: int = 16, resume_tick: int = None):
+        stats = PopulationStats(self.simulation, bins)
+        writer = StatsWriter(path, bins, resume_tick)
+        self.add_periodic(every, lambda: writer.write(self.simulation.tick, stats.collect()))
+        self.on_finish.append(writer.close)
+
+    def enable_checkpoints(self, every: int, path: str):
+        # Snapshots are copied to host memory on the stepping thread, and the
+        # disk write happens on a background thread. If the previous write is
+        # still running, the new checkpoint is skipped instead of waiting.
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        pending = []
+
+        def checkpoint():
+            if pending and not pending[-1].done():
+                print(f"tick {self.simulation.tick}: previous checkpoint still writing, skipped")
+                return
+            pending[:] = [writer.submit(write_checkpoint, path, *self.simulation.snapshot())]
+
+        self.add_periodic(every, checkpoint)
+        self.on_finish.append(lambda: writer.shutdown(wait=True))
+
+    def enable_capture(self, every: int, directory: str, fmt: str = "png", block: bool = False,
+                       view_size: tuple = None):
+        # Offscreen: the scene is only rendered on capture ticks.
+        from core.renderer import Renderer
+
+        renderer = Renderer(self.simulation, view_size)
+        capture = FrameCapture(renderer, directory, fmt, block=block)
+
+        def grab():
+            renderer.render_scene()
+            capture.capture()
+
+        def finish():
+            capture.close()
+            print(f"Captured {capture.written} frames to {directory} ({capture.dropped} dropped)")
+
+        self.add_periodic(every, grab)
+        self.on_finish.append(finish)
+
+    def run(self, ticks: int, report_every: int, resume: str = None):
+        start = time.perf_counter()
+        if resume:
+            self.simulation.load_checkpoint(resume)
+            print(f"Resumed from {resume} at tick {self.simulation.tick}")
+        else:
+            self.simulation.initialize()
+        ti.sync()
+        print(f"Started in {self.init_seconds + time.perf_counter() - start:.2f}s "
+              f"(ti.init {self.init_seconds:.2f}s)")
+        self.add_periodic(report_every, self._report)
+
+        start = time.perf_counter()
+        first_tick = self.simulation.tick
+        self._last_report = (start, first_tick)
+        while self.simulation.tick < ticks:
+            tick = self.simulation.tick
+            next_stop = min([ticks] + [(tick // every + 1) * every for every, _ in self.periodic])
+            self.simulation.step(next_stop - tick)
+
+            for every, callback in self.periodic:
+                if self.simulation.tick % every == 0:
+                    callback()
+
+        self.simulation.drain_events()
+        for callback in self.on_finish:
+            callback()
+
+        elapsed = time.perf_counter() - start
+        ran = self.simulation.tick - first_tick
+        print(f"Ran {ran} ticks in {elapsed:.2f}s ({ran / max(elapsed, 1e-9):.0f} ticks/s)")
+
+        if self.profiler:
+            self.profiler.report()
+            if self.trace_path:
+                self.profiler.dump_trace(self.trace_path)
+
+    def _report(self):
+        alive = self.simulation.total_alive.to_numpy().sum()
+        generation = self.simulation.max_generation.to_numpy().max()
+        now = time.perf_counter()
+        last_time, last_tick = self._last_report
+        rate = (self.simulation.tick - last_tick) / (now - last_time)
+        self._last_report = (now, self.simulation.tick)
+        print(f"tick {self.simulation.tick}: alive={alive} generation={generation} ({rate:.0f} ticks/s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the evolution simulator without a window.")
+    parser.add_argument("--ticks", type=int, default=10000, help="tick to run the simulation up to")
+    parser.add_argument("--report-every", type=int, default=1000, help="ticks between progress lines")
+    parser.add_argument("--stats-every", type=int, default=0,
+                        help="ticks between population statistics samples (0 disables)")
+    parser.add_argument("--stats-out", default="stats.csv", help="CSV file statistics are appended to")
+    parser.add_argument("--stats-bins", type=int, default=16, help="histogram bins per trait")
+    parser.add_argument("--checkpoint-every", type=int, default=0,
+                        help="ticks between automatic checkpoints (0 disables)")
+    parser.add_argument("--checkpoint-path", default="simulation.ckpt", help="file automatic checkpoints go to")
+    parser.add_argument("--resume", help="checkpoint to resume from; its config replaces the config flags")
+    parser.add_argument("--capture", metavar="DIR", help="render and save frames offscreen into DIR")
+    parser.add_argument("--capture-every", type=int, default=10, help="ticks between captured frames")
+    parser.add_argument("--capture-format", choices=FORMATS, default="png",
+                        help="PNG sequence or one raw RGB24 stream")
+    parser.add_argument("--capture-block", action="store_true",
+                        help="wait for the writer instead of dropping frames when it falls behind")
+    parser.add_argument("--capture-view", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="capture only this much of the world, from its lower-left corner "
+                             "(default: the world, up to 1000x1000)")
+    parser.add_argument("--profile", action="store_true",
+                        help="run the update phase by phase and print per-phase and per-kernel timings")
+    parser.add_argument("--trace", help="write a Chrome trace of the profiled phases here on exit")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="compile this config's kernels into the cache directory and exit")
+    add_startup_arguments(parser)
+    SimulationConfig.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng_seed = resume_tick = None
+    if args.resume:
+        meta, _ = read_checkpoint(args.resume)
+        config = SimulationConfig.from_dict(meta["config"])
+        # Taichi's RNG state is not checkpointed. Seeding it from the tick
+        # keeps a resumed run from replaying the draws of the run's first
+        # ticks; only deterministic runs resume exactly.
+        rng_seed = world_seed(config.seed, meta["tick"]) & 0x7FFFFFFF
+        resume_tick = meta["tick"]
+    else:
+        config = SimulationConfig.from_args(args)
+
+    if args.warm_cache:
+        init_taichi(args.arch, config.seed, args.threads, args.cache_dir)
+        seconds = warm_cache(config, render=bool(args.capture), view_size=args.capture_view)
+        print(f"Compiled kernels in {seconds:.2f}s -> {args.cache_dir}")
+        return
+
+    app = HeadlessApplication(config, args.arch, args.profile or bool(args.trace), args.trace, args.threads,
+                              args.cache_dir, rng_seed)
+    if args.stats_every > 0:
+        app.enable_stats(args.stats_every, args.stats_out, args.stats_bins, resume_tick)
+    if args.checkpoint_every > 0:
+        app.enable_checkpoints(args.checkpoint_every, args.checkpoint_path)
+    if args.capture:
+        app.enable_capture(args.capture_every, args.capture, args.capture_format, args.capture_block,
+                           args.capture_view)
+    app.run(args.ticks, args.report_every, args.resume)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
+import math
 import taichi as ti
-from core.config import MUTATION_RATE, MAX_FOOD, FOOD_SPAWN_RATE, MUTATION_STRENGTH
+from core.config import DT
 from core.events import EventManager, Event, EventType
 
+# With no explicit cap, a frame may run this many 60 Hz frames' worth of
+# ticks before the rest of the backlog is dropped.
+BACKLOG_FRAMES = 4
+
 class Layer:
     def on_attach(self):
         pass
@@ -19,13 +24,24 @@ class Layer:
         pass
 
 class SimulationLayer(Layer):
-    def __init__(self, simulation, renderer, event_manager: EventManager):
+    def __init__(self, simulation, renderer, event_manager: EventManager,
+                 sim_dt: float = DT, speed: float = 1.0, max_steps_per_frame: int = 0):
         self.simulation = simulation
         self.renderer = renderer
         self.event_manager = event_manager
         self.running = False
         self.initialized = False
-        self.frame = 0
+
+        # Fixed-timestep accumulator: wall-clock frame time scaled by `speed`
+        # is paid out as whole sim_dt ticks, so a run evolves at the same rate
+        # per simulated second whatever the frame rate is.
+        self.sim_dt = sim_dt
+        self.speed = speed
+        # 0 derives the cap from the current speed, which the Controls panel
+        # can change.
+        self.max_steps_per_frame = max_steps_per_frame
+        self.accumulator = 0.0
+        self.steps_last_frame = 0
 
     def on_attach(self):
         self.simulation.initialize()
@@ -47,13 +63,23 @@ class SimulationLayer(Layer):
         self.simulation.initialize()
         self.initialized = True
         self.running = False
-        self.frame = 0
+        self.accumulator = 0.0
 
     def on_update(self, dt: float):
+        self.steps_last_frame = 0
         if self.running and self.initialized:
-            should_reproduce = 1 if self.frame % 30 == 0 else 0
-            self.simulation.update(dt, should_reproduce)
-            self.frame += 1
+            self.accumulator += dt * self.speed
+            steps = int(self.accumulator / self.sim_dt)
+            max_steps = self.max_steps_per_frame or math.ceil(BACKLOG_FRAMES * self.speed / (self.sim_dt * 60))
+            if steps > max_steps:
+                # The simulation cannot keep up; drop the backlog instead of
+                # letting it grow every frame.
+                steps = max_steps
+                self.accumulator = 0.0
+            else:
+                self.accumulator -= steps * self.sim_dt
+            self.simulation.step(steps, self.sim_dt)
+            self.steps_last_frame = steps
 
     def on_render(self):
         if self.initialized and self.running:
@@ -65,13 +91,23 @@ class SimulationLayer(Layer):
             self.renderer.render_start_screen()
 
 class UILayer(Layer):
-    def __init__(self, simulation_layer: SimulationLayer, simulation):
+    def __init__(self, simulation_layer: SimulationLayer, simulation, profiler=None):
         self.simulation_layer = simulation_layer
         self.simulation = simulation
-        self.mutation_rate = MUTATION_RATE
-        self.max_food = MAX_FOOD
-        self.food_spawn_rate = FOOD_SPAWN_RATE
-        self.mutation_strength = MUTATION_STRENGTH
+        self.profiler = profiler
+        params = simulation.get_params()
+        self.mutation_rate = params["mutation_rate"]
+        self.max_food = params["max_food"]
+        self.food_spawn_rate = params["food_spawn_rate"]
+        self.mutation_strength = params["mutation_strength"]
+        self.separation_strength = params["separation_strength"]
+
+    def _apply_params(self, **params):
+        changed = {name: value for name, value in params.items() if value != getattr(self, name)}
+        if changed:
+            for name, value in changed.items():
+                setattr(self, name, value)
+            self.simulation.set_params(**changed)
 
     def on_gui_render(self, gui):
         with gui.sub_window(name='Controls', x=0, y=0, width=0.3, height=0.15):
@@ -87,33 +123,68 @@ class UILayer(Layer):
             status = 'Running' if self.simulation_layer.running else 'Paused'
             gui.text(f"Status: {status}")
 
-            generation = self.simulation.max_generation[None] if self.simulation_layer.initialized else 0
+            generation = self.simulation.max_generation[0] if self.simulation_layer.initialized else 0
             gui.text(f"Generation: {generation}")
 
-            alive = self.simulation.total_alive[None] if self.simulation_layer.initialized else 0
+            alive = self.simulation.total_alive[0] if self.simulation_layer.initialized else 0
             gui.text(f"Alive: {alive}")
 
-            self.mutation_rate = gui.slider_float(
+            self.simulation_layer.speed = gui.slider_float(
+                text='Speed',
+                old_value=self.simulation_layer.speed,
+                minimum=0.25,
+                maximum=100.0
+            )
+            gui.text(f"Ticks/frame: {self.simulation_layer.steps_last_frame}")
+
+            renderer = self.simulation_layer.renderer
+            renderer.show_vision = gui.checkbox('Vision Rings', renderer.show_vision)
+            renderer.binned = gui.checkbox('Stable Draw Order', renderer.binned)
+            if renderer.show_vision and not renderer.rings_drawn[None]:
+                gui.text("Too many creatures to draw vision rings")
+
+            mutation_rate = gui.slider_float(
                 text='Mutation Rate',
                 old_value=self.mutation_rate,
                 minimum=0.0,
                 maximum=1.0
             )
-            self.max_food = gui.slider_int(
+            max_food = gui.slider_int(
                 text='Max Food',
                 old_value=self.max_food,
                 minimum=1,
-                maximum=500
+                maximum=self.simulation.config.max_food
             )
-            self.food_spawn_rate = gui.slider_float(
+            food_spawn_rate = gui.slider_float(
                 text='Food Spawn Rate',
                 old_value=self.food_spawn_rate,
                 minimum=0.0,
                 maximum=1.0
             )
-            self.mutation_strength = gui.slider_float(
+            mutation_strength = gui.slider_float(
                 text='Mutation Strength',
                 old_value=self.mutation_strength,
                 minimum=0.0,
                 maximum=1.0
             )
+
+            separation_strength = gui.slider_float(
+                text='Separation',
+                old_value=self.separation_strength,
+                minimum=0.0,
+                maximum=1.0
+            )
+
+            self._apply_params(
+                mutation_rate=mutation_rate,
+                max_food=max_food,
+                food_spawn_rate=food_spawn_rate,
+                mutation_strength=mutation_strength,
+                separation_strength=separation_strength
+            )
+
+        if self.profiler:
+            timings = self.profiler.summary()
+            with gui.sub_window(name='Profiler', x=0.7, y=0, width=0.3, height=0.25):
+                for name, timing in timings.items():
+                    gui.text(f"{name}: {timing['mean_ms']:.2f}ms (max {timing['max_ms']:.2f})")
@@ -1,52 +1,146 @@
+import argparse
+import time
+from contextlib import nullcontext
 import taichi as ti
-from core.config import WIDTH, HEIGHT
+from core.config import SimulationConfig
 from core.simulation import Simulation
 from core.renderer import Renderer
 from core.events import EventManager
+from core.capture import FrameCapture, FORMATS
+from core.profiler import Profiler
 from app.layers import SimulationLayer, UILayer
+from app.startup import DEFAULT_CACHE_DIR, add_arguments as add_startup_arguments, init_taichi, warm_cache
+
+
+PAN_SPEED = 600.0
+# Longer frames, such as the first one's kernel compile, count as this long.
+MAX_FRAME_TIME = 0.25
+PAN_KEYS = {
+    ti.ui.LEFT: (-1, 0),
+    ti.ui.RIGHT: (1, 0),
+    ti.ui.UP: (0, 1),
+    ti.ui.DOWN: (0, -1),
+}
 
 
 class Application:
-    def __init__(self):
-        print(f"ti.gpu: {ti.gpu}")
-        ti.init(arch=ti.gpu)
+    def __init__(self, config: SimulationConfig = None, profile: bool = False, trace_path: str = None,
+                 view_size: tuple = None, arch: str = "gpu", threads: int = 0, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.config = config or SimulationConfig()
+        init_seconds = init_taichi(arch, self.config.seed, threads, cache_dir, kernel_profiler=profile)
+        print(f"ti.init({arch}) took {init_seconds:.2f}s")
 
         self.event_manager = EventManager()
-        self.simulation = Simulation(self.event_manager)
-        self.renderer = Renderer(self.simulation.creatures, self.simulation.food)
+        self.simulation = Simulation(self.event_manager, self.config)
+        self.renderer = Renderer(self.simulation, view_size)
+
+        self.profiler = Profiler(kernel_profiler=True) if profile else None
+        self.simulation.profiler = self.profiler
+        self.trace_path = trace_path
+        self.capture = None
 
         self.layers = []
-        self.dt = 0.016
 
     def add_layer(self, layer):
         self.layers.append(layer)
         layer.on_attach()
 
+    def _section(self, name: str):
+        return self.profiler.section(name) if self.profiler else nullcontext()
+
+    def _pan(self, window, frame_time: float):
+        # Arrow keys scroll the view when it is smaller than the world.
+        step = int(PAN_SPEED * frame_time)
+        for key, (dx, dy) in PAN_KEYS.items():
+            if window.is_pressed(key):
+                self.renderer.pan(dx * step, dy * step)
+
     def run(self):
-        window = ti.ui.Window("Evolution Simulator", (WIDTH, HEIGHT), show_window=True)
+        window = ti.ui.Window("Evolution Simulator", (self.renderer.width, self.renderer.height), show_window=True)
         canvas = window.get_canvas()
         gui = window.get_gui()
 
+        last_frame = time.perf_counter()
         while window.running:
-            for layer in self.layers:
-                layer.on_update(self.dt)
+            now = time.perf_counter()
+            frame_time, last_frame = min(now - last_frame, MAX_FRAME_TIME), now
 
-            for layer in self.layers:
-                layer.on_render()
+            with self._section("frame"):
+                with self._section("update"):
+                    self._pan(window, frame_time)
+                    for layer in self.layers:
+                        layer.on_update(frame_time)
 
-            for layer in self.layers:
-                layer.on_gui_render(gui)
+                with self._section("render"):
+                    for layer in self.layers:
+                        layer.on_render()
 
-            canvas.set_image(self.renderer.get_pixels())
-            window.show()
+                if self.capture:
+                    with self._section("capture"):
+                        self.capture.capture()
 
-        gui.end()
+                with self._section("gui"):
+                    for layer in self.layers:
+                        layer.on_gui_render(gui)
 
-def main():
-    app = Application()
+                with self._section("present"):
+                    canvas.set_image(self.renderer.get_pixels())
+                    window.show()
 
-    simulation_layer = SimulationLayer(app.simulation, app.renderer, app.event_manager)
-    ui_layer = UILayer(simulation_layer, app.simulation)
+        gui.end()
+        self.simulation.drain_events()
+
+        if self.capture:
+            self.capture.close()
+            print(f"Captured {self.capture.written} frames ({self.capture.dropped} dropped)")
+
+        if self.profiler:
+            self.profiler.report()
+            if self.trace_path:
+                self.profiler.dump_trace(self.trace_path)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the evolution simulator.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="simulated seconds per wall-clock second; raise it to fast-forward")
+    parser.add_argument("--max-steps-per-frame", type=int, default=0,
+                        help="ticks a single frame may run before the backlog is dropped "
+                             "(0 = four 60 Hz frames' worth at the current speed)")
+    parser.add_argument("--view", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="window size in world units (default: the world, up to 1000x1000); "
+                             "when smaller than the world, arrow keys pan the view")
+    parser.add_argument("--capture", metavar="DIR", help="save rendered frames into DIR without screen capture")
+    parser.add_argument("--capture-stride", type=int, default=1, help="save every Nth frame")
+    parser.add_argument("--capture-format", choices=FORMATS, default="png",
+                        help="PNG sequence or one raw RGB24 stream")
+    parser.add_argument("--capture-block", action="store_true",
+                        help="wait for the writer instead of dropping frames when it falls behind")
+    parser.add_argument("--profile", action="store_true", help="time each update phase and frame stage")
+    parser.add_argument("--trace", help="write a Chrome trace of the profiled sections here on exit")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="compile this config's simulation and render kernels into the cache directory and exit")
+    add_startup_arguments(parser, default_arch="gpu")
+    SimulationConfig.add_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = SimulationConfig.from_args(args)
+    if args.warm_cache:
+        init_taichi(args.arch, config.seed, args.threads, args.cache_dir)
+        seconds = warm_cache(config, render=True, view_size=args.view)
+        print(f"Compiled kernels in {seconds:.2f}s -> {args.cache_dir}")
+        return
+
+    app = Application(config, args.profile or bool(args.trace), args.trace, args.view, args.arch, args.threads,
+                      args.cache_dir)
+    if args.capture:
+        app.capture = FrameCapture(app.renderer, args.capture, args.capture_format, args.capture_stride,
+                                   block=args.capture_block)
+
+    simulation_layer = SimulationLayer(app.simulation, app.renderer, app.event_manager,
+                                       speed=args.speed, max_steps_per_frame=args.max_steps_per_frame)
+    ui_layer = UILayer(simulation_layer, app.simulation, app.profiler)
 
     app.add_layer(simulation_layer)
     app.add_layer(ui_layer)
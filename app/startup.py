@@ -0,0 +1,62 @@
+import os
+import time
+from core.config import SimulationConfig
+
+# Taichi is only imported once a backend is initialised, so sweep and
+# benchmark parents that just spawn workers never load it.
+ARCHS = ("cpu", "gpu", "cuda", "vulkan")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "evolution-simulator", "kernels")
+
+
+def add_arguments(parser, default_arch: str = "cpu", arch: bool = True):
+    group = parser.add_argument_group("startup")
+    if arch:
+        group.add_argument("--arch", choices=sorted(ARCHS), default=default_arch, help="Taichi backend")
+        group.add_argument("--threads", type=int, default=0, help="CPU backend threads (0 = one per core)")
+    group.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                       help="directory compiled kernels are kept in between runs")
+    group.add_argument("--no-cache", dest="cache_dir", action="store_const", const=None,
+                       help="compile every kernel from scratch")
+
+
+def init_taichi(arch: str = "cpu", seed: int = 0, threads: int = 0, cache_dir: str = DEFAULT_CACHE_DIR,
+                **options) -> float:
+    import taichi as ti
+
+    # Kernels are keyed on their source and the config values baked into
+    # them, so runs with the same config load them from cache_dir instead of
+    # compiling them again. Returns the seconds ti.init took.
+    start = time.perf_counter()
+    if cache_dir:
+        options.update(offline_cache=True, offline_cache_file_path=cache_dir)
+    else:
+        options.update(offline_cache=False)
+    if threads > 0:
+        options.update(cpu_max_num_threads=threads)
+    ti.init(arch=getattr(ti, arch), random_seed=seed, **options)
+    return time.perf_counter() - start
+
+
+def warm_cache(config: SimulationConfig, render: bool = False, view_size: tuple = None) -> float:
+    # Launches every kernel a run of this config uses once on a throwaway
+    # simulation, so they are compiled into the offline cache, which Taichi
+    # writes out on ti.reset() or exit. Call it in a process of its own.
+    import taichi as ti
+    from core.events import EventManager
+    from core.simulation import Simulation
+
+    start = time.perf_counter()
+    simulation = Simulation(EventManager(), config)
+    simulation.initialize()
+    # One fused launch when ticks_per_launch > 1, then a single tick.
+    simulation.step(config.ticks_per_launch + 1)
+    if render:
+        from core.renderer import Renderer
+
+        renderer = Renderer(simulation, view_size)
+        renderer.render_scene()
+        renderer.render_paused_overlay()
+        renderer.render_start_screen()
+    ti.sync()
+    return time.perf_counter() - start
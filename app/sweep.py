@@ -0,0 +1,172 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import fields, replace
+from core.config import SimulationConfig
+from app.startup import add_arguments as add_startup_arguments
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+_worker_threads = None
+_worker_cache_dir = None
+
+
+def _init_worker(threads: int, cache_dir: str):
+    global _worker_threads, _worker_cache_dir
+    _worker_threads = threads
+    _worker_cache_dir = cache_dir
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+
+def summarize(simulation) -> list:
+    from core.stats import PopulationStats, TRAITS
+
+    stats = PopulationStats(simulation).collect()
+    rows = []
+    for w in range(simulation.config.num_worlds):
+        row = {
+            "world": w,
+            "total_alive": int(simulation.total_alive[w]),
+            "max_generation": int(simulation.max_generation[w]),
+        }
+        for t, trait in enumerate(TRAITS):
+            row[f"mean_{trait}"] = float(stats["mean"][w, t]) if stats["count"][w] else float("nan")
+        rows.append(row)
+    return rows
+
+
+def warm_one(overrides: dict, cache_dir: str) -> float:
+    import taichi as ti
+    from app.startup import init_taichi, warm_cache
+
+    config = replace(SimulationConfig(), **overrides)
+    init_taichi("cpu", config.seed, cache_dir=cache_dir, log_level=ti.WARN)
+    return warm_cache(config)
+
+
+def run_one(run_id: int, overrides: dict, ticks: int) -> list:
+    import taichi as ti
+    from app.startup import init_taichi
+    from core.events import EventManager
+    from core.simulation import Simulation
+
+    # Re-initialising per run gives every run its own seed. Runs whose
+    # configs compile to the same kernels load them from the cache.
+    config = replace(SimulationConfig(), **overrides)
+    init_taichi("cpu", config.seed, _worker_threads, _worker_cache_dir, log_level=ti.WARN)
+    simulation = Simulation(EventManager(), config)
+    simulation.initialize()
+
+    start = time.perf_counter()
+    simulation.step(ticks)
+    elapsed = time.perf_counter() - start
+
+    return [
+        {"run": run_id, **overrides, **summary, "ticks": ticks, "seconds": elapsed}
+        for summary in summarize(simulation)
+    ]
+
+
+def expand_grid(grid: dict, repeats: int = 1) -> list:
+    known = {f.name for f in fields(SimulationConfig)}
+    unknown = set(grid) - known
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    names = sorted(grid)
+    values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+    runs = [dict(zip(names, combo)) for combo in itertools.product(*values)]
+    if repeats > 1 and "seed" not in grid:
+        # Repeats of a combination differ only by seed, which is recorded so
+        # any single run can be reproduced.
+        return [{**run, "seed": r} for run in runs for r in range(repeats)]
+    return [run for run in runs for _ in range(repeats)]
+
+
+def parse_assignment(text: str):
+    name, _, values = text.partition("=")
+    name = name.replace("-", "_")
+    field_types = {f.name: f.type for f in fields(SimulationConfig)}
+    if name not in field_types:
+        raise argparse.ArgumentTypeError(f"Unknown sweep parameter: {name}")
+    return name, [field_types[name](v) for v in values.split(",")]
+
+
+class SweepRunner:
+    def __init__(self, workers: int, threads_per_worker: int, cache_dir: str = None):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.cache_dir = cache_dir
+
+    def run(self, runs: list, ticks: int, out_path: str):
+        done = 0
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+
+        if self.cache_dir and runs:
+            # Compile the first run's kernels once, so the first wave of
+            # workers loads them from the cache instead of each compiling them.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                seconds = pool.submit(warm_one, runs[0], self.cache_dir).result()
+            print(f"Compiled kernels in {seconds:.1f}s -> {self.cache_dir}")
+
+        with open(out_path, "w", newline="") as out, ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.cache_dir)
+        ) as pool:
+            futures = [pool.submit(run_one, run_id, overrides, ticks) for run_id, overrides in enumerate(runs)]
+            writer = None
+            for future in as_completed(futures):
+                rows = future.result()
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(rows[0]), extrasaction="ignore", restval="")
+                    writer.writeheader()
+                writer.writerows(rows)
+                out.flush()
+
+                done += 1
+                print(f"[{done}/{len(runs)}] run {rows[0]['run']}: alive={rows[0]['total_alive']} "
+                      f"generation={rows[0]['max_generation']}")
+
+        print(f"Finished {len(runs)} runs in {time.perf_counter() - start:.1f}s -> {out_path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of headless simulations in parallel.")
+    parser.add_argument("--grid", help="JSON file mapping config fields to lists of values")
+    parser.add_argument("--set", dest="assignments", action="append", type=parse_assignment, default=[],
+                        metavar="NAME=V1,V2", help="sweep a config field over comma-separated values")
+    parser.add_argument("--ticks", type=int, default=10000, help="ticks per run")
+    parser.add_argument("--repeats", type=int, default=1, help="runs per parameter combination")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Taichi CPU threads per worker (default: cores / workers)")
+    parser.add_argument("--out", default="sweep_results.csv", help="CSV file the per-run summaries stream into")
+    add_startup_arguments(parser, arch=False)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    grid = {}
+    if args.grid:
+        with open(args.grid) as f:
+            grid.update(json.load(f))
+    grid.update(dict(args.assignments))
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    runner = SweepRunner(args.workers, threads, args.cache_dir)
+    runner.run(expand_grid(grid, args.repeats), args.ticks, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+from app.benchmark import main
+
+if __name__ == "__main__":
+    main()
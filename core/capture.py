@@ -0,0 +1,118 @@
+import os
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+import taichi as ti
+
+FORMATS = ("png", "raw")
+
+
+def write_png(path: str, image: np.ndarray, level: int = 3):
+    # Minimal RGB8 PNG encoder; zlib releases the GIL while it compresses, so
+    # encoding on the writer thread does not hold up the simulation thread.
+    height, width, _ = image.shape
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), level)))
+        f.write(chunk(b"IEND", b""))
+
+
+# Copies every `stride`-th frame of Renderer.pixels into one of `pool_size`
+# preallocated RGB8 buffers and hands it to a writer thread, which encodes it
+# and returns the buffer to the pool. When every buffer is still waiting to
+# be written the frame is dropped (or, with block=True, capture() waits for a
+# buffer), so memory stays bounded and the caller never waits on the disk.
+#
+# Frames are numbered in the order they are written, without gaps for
+# dropped frames. "png" writes frame_000000.png, ... into `directory`; "raw"
+# appends frames to directory/frames.rgb, which ffmpeg reads with
+#   -f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT
+@ti.data_oriented
+class FrameCapture:
+    def __init__(self, renderer, directory: str, fmt: str = "png", stride: int = 1,
+                 pool_size: int = 4, block: bool = False):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown capture format: {fmt}")
+        self.renderer = renderer
+        self.directory = directory
+        self.fmt = fmt
+        self.stride = max(1, stride)
+        self.block = block
+        self.width = renderer.width
+        self.height = renderer.height
+
+        self.frames_seen = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.raw_file = open(os.path.join(directory, "frames.rgb"), "wb") if fmt == "raw" else None
+
+        self.free = queue.Queue()
+        for _ in range(pool_size):
+            self.free.put(np.empty((self.height, self.width, 3), dtype=np.uint8))
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, name="frame-writer", daemon=True)
+        self.writer.start()
+
+    def capture(self) -> bool:
+        if self.error is not None:
+            raise RuntimeError("frame writer failed") from self.error
+
+        index = self.frames_seen
+        self.frames_seen += 1
+        if index % self.stride != 0:
+            return False
+
+        try:
+            buffer = self.free.get(block=self.block)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+
+        self._copy_frame(buffer)
+        self.pending.put(buffer)
+        return True
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        if self.raw_file is not None:
+            self.raw_file.close()
+        if self.error is not None:
+            raise RuntimeError("frame writer failed") from self.error
+
+    def _write_loop(self):
+        while True:
+            buffer = self.pending.get()
+            if buffer is None:
+                return
+            try:
+                if self.error is None:
+                    if self.raw_file is not None:
+                        self.raw_file.write(buffer.data)
+                    else:
+                        write_png(os.path.join(self.directory, f"frame_{self.written:06d}.png"), buffer)
+                    self.written += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(buffer)
+
+    @ti.kernel
+    def _copy_frame(self, dst: ti.types.ndarray(dtype=ti.u8, ndim=3)):
+        # pixels is (x, y) with y up; images are (row, column) from the top.
+        for i, j in self.renderer.pixels:
+            color = ti.math.clamp(self.renderer.pixels[i, j], 0.0, 1.0)
+            for c in ti.static(range(3)):
+                dst[self.height - 1 - j, i, c] = ti.cast(color[c] * 255.0 + 0.5, ti.u8)
@@ -0,0 +1,54 @@
+import json
+import os
+import struct
+import numpy as np
+
+# File layout: MAGIC, a little-endian u64 header length, a JSON header, then
+# every array as raw C-order bytes at the 64-byte aligned offset recorded in
+# the header, so each one can be memory-mapped straight back.
+MAGIC = b"EVOCKPT1"
+ALIGN = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_checkpoint(path: str, meta: dict, arrays: dict):
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = json.dumps({"meta": meta, "arrays": entries}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    # Write next to the target and rename, so a crash mid-write never
+    # replaces a good checkpoint with a torn one.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a simulation checkpoint")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    data_start = _align(len(MAGIC) + 8 + header_len)
+
+    arrays = {
+        name: np.memmap(path, dtype=np.dtype(entry["dtype"]), mode="r",
+                        offset=data_start + entry["offset"], shape=tuple(entry["shape"]))
+        for name, entry in header["arrays"].items()
+    }
+    return header["meta"], arrays
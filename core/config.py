@@ -1,3 +1,8 @@
+import argparse
+import json
+import math
+from dataclasses import dataclass, asdict, fields, replace
+
 WIDTH = 1000
 HEIGHT = 1000
 MAX_CREATURES = 500
@@ -8,7 +13,132 @@ FOOD_SPAWN_RATE = 0.2
 MUTATION_RATE = 0.2
 MUTATION_STRENGTH = 0.2
 
-GRID_CELL_SIZE = 100
-GRID_WIDTH = (WIDTH + GRID_CELL_SIZE - 1) // GRID_CELL_SIZE
-GRID_HEIGHT = (HEIGHT + GRID_CELL_SIZE - 1) // GRID_CELL_SIZE
-MAX_ITEMS_PER_CELL = 50
+DT = 0.016
+REPRODUCTION_INTERVAL = 30
+
+SEPARATION_STRENGTH = 0.5
+
+MAX_VISION_RANGE = 150.0
+MAX_CREATURE_SIZE = 15.0
+
+# Upper ends of the trait ranges new creatures are drawn from.
+INITIAL_SIZE_RANGE = (3.0, 7.0)
+INITIAL_VISION_RANGE = (35.0, 75.0)
+
+
+@dataclass(frozen=True)
+class SimulationConfig:
+    # Independent worlds advanced together by every kernel launch.
+    num_worlds: int = 1
+    width: int = WIDTH
+    height: int = HEIGHT
+    max_creatures: int = MAX_CREATURES
+    max_food: int = MAX_FOOD
+    initial_creatures: int = INITIAL_CREATURES
+    initial_food: int = INITIAL_FOOD
+    food_spawn_rate: float = FOOD_SPAWN_RATE
+    mutation_rate: float = MUTATION_RATE
+    mutation_strength: float = MUTATION_STRENGTH
+    separation_strength: float = SEPARATION_STRENGTH
+    max_vision_range: float = MAX_VISION_RANGE
+    max_creature_size: float = MAX_CREATURE_SIZE
+    # Simulated seconds between reproduction rounds, independent of dt and
+    # of how often frames are drawn.
+    reproduction_period: float = REPRODUCTION_INTERVAL * DT
+    # Ticks unrolled into a single kernel launch by Simulation.step(); more
+    # means fewer launches per tick but longer compile times.
+    ticks_per_launch: int = 1
+    # Room for CREATURE_BORN / CREATURE_DIED / FOOD_EATEN / FOOD_SPAWNED
+    # events between drains; 0 compiles event recording out of the kernels.
+    event_capacity: int = 0
+    event_drain_interval: int = 1
+    # 0 sizes the grid cells from max_vision_range so a vision query never
+    # needs more than a 3x3 block of cells.
+    grid_cell_size: int = 0
+    # 0 keeps the spatial grids dense. N > 0 allocates them in chunks of N x N
+    # cells only where items are, for very large, sparsely populated worlds.
+    grid_chunk_size: int = 0
+    # 1 stores creatures and food as structure-of-arrays (one array per
+    # member) instead of array-of-structs, so a pass that reads a few members
+    # only streams those, and population views gather contiguous columns.
+    soa_layout: int = 0
+    # Seeds ti.init and the per-world random streams. With deterministic=1
+    # every draw comes from a counter-based hash of (seed, world, tick,
+    # entity) and order-dependent passes run serially, so two runs with the
+    # same config are bit-identical on the CPU backend.
+    seed: int = 0
+    deterministic: int = 0
+
+    def __post_init__(self):
+        # Kernels index fields with these values unchecked, so reject configs
+        # that would read or write out of bounds before any field is built.
+        for name in ("num_worlds", "width", "height", "max_creatures", "max_food"):
+            if getattr(self, name) < 1:
+                raise ValueError(f"{name} must be at least 1, got {getattr(self, name)}")
+        if not 0 <= self.initial_creatures <= self.max_creatures:
+            raise ValueError(f"initial_creatures must be in [0, max_creatures={self.max_creatures}], "
+                             f"got {self.initial_creatures}")
+        if not 0 <= self.initial_food <= self.max_food:
+            raise ValueError(f"initial_food must be in [0, max_food={self.max_food}], got {self.initial_food}")
+        # The renderer's tile capacity and the creature grid's cell size are
+        # sized from these, so they must cover every creature that can exist.
+        if self.max_creature_size < INITIAL_SIZE_RANGE[1]:
+            raise ValueError(f"max_creature_size must be at least {INITIAL_SIZE_RANGE[1]}, "
+                             f"got {self.max_creature_size}")
+        if self.max_vision_range < INITIAL_VISION_RANGE[1]:
+            raise ValueError(f"max_vision_range must be at least {INITIAL_VISION_RANGE[1]}, "
+                             f"got {self.max_vision_range}")
+
+    @property
+    def cell_size(self) -> int:
+        if self.grid_cell_size > 0:
+            return self.grid_cell_size
+        return max(1, min(math.ceil(self.max_vision_range), self.width, self.height))
+
+    @property
+    def creature_cell_size(self) -> int:
+        # Two bodies can only touch if their centres are within twice the
+        # largest size, so that is all a contact query ever has to cover.
+        return max(1, min(math.ceil(2 * self.max_creature_size), self.width, self.height))
+
+    @property
+    def grid_width(self) -> int:
+        return (self.width + self.cell_size - 1) // self.cell_size
+
+    @property
+    def grid_height(self) -> int:
+        return (self.height + self.cell_size - 1) // self.cell_size
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SimulationConfig":
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    @classmethod
+    def from_file(cls, path: str) -> "SimulationConfig":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        group = parser.add_argument_group("simulation config")
+        group.add_argument("--config", help="JSON file with simulation config values")
+        for f in fields(cls):
+            group.add_argument(f"--{f.name.replace('_', '-')}", type=f.type, default=None,
+                               help=f"default: {f.default}")
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "SimulationConfig":
+        config = cls.from_file(args.config) if args.config else cls()
+        overrides = {f.name: getattr(args, f.name) for f in fields(cls) if getattr(args, f.name) is not None}
+        return replace(config, **overrides)
@@ -21,3 +21,4 @@ class Food:
     pos: ti.math.vec2
     energy: ti.f32
     active: ti.i32
+    claimed_by: ti.i32
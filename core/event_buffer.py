@@ -0,0 +1,72 @@
+import taichi as ti
+from core.events import EventManager, Event, EventType
+
+# Event kinds the kernels can record, in the order of their kind codes.
+BUFFERED_EVENTS = (
+    EventType.CREATURE_BORN,
+    EventType.CREATURE_DIED,
+    EventType.FOOD_EATEN,
+    EventType.FOOD_SPAWNED,
+)
+CREATURE_BORN, CREATURE_DIED, FOOD_EATEN, FOOD_SPAWNED = range(len(BUFFERED_EVENTS))
+
+
+@ti.dataclass
+class SimEvent:
+    kind: ti.i32
+    tick: ti.i32
+    world: ti.i32
+    entity: ti.i32
+    other: ti.i32
+    value: ti.f32
+
+
+# Append-only device buffer the kernels record events into with an atomic
+# cursor. drain() copies it to NumPy in one go, dispatches one batched Event
+# per type to EventManager subscribers and rewinds the cursor. Events that
+# arrive while the buffer is full are counted in `overflow`, not stored.
+#
+# Per kind, `entity` / `other` / `value` hold:
+#   CREATURE_BORN  child slot, parent slot, generation
+#   CREATURE_DIED  creature slot, generation, age
+#   FOOD_EATEN     food slot, eating creature slot, energy
+#   FOOD_SPAWNED   food slot, -1, energy
+@ti.data_oriented
+class EventBuffer:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.events = SimEvent.field(shape=capacity)
+        self.count = ti.field(dtype=ti.i32, shape=())
+        self.overflow = ti.field(dtype=ti.i32, shape=())
+        self.dropped = 0
+
+    @ti.func
+    def push(self, kind: ti.i32, tick: ti.i32, world: ti.i32, entity: ti.i32, other: ti.i32, value: ti.f32):
+        idx = ti.atomic_add(self.count[None], 1)
+        if idx < self.capacity:
+            self.events[idx] = SimEvent(kind=kind, tick=tick, world=world, entity=entity, other=other, value=value)
+        else:
+            ti.atomic_add(self.overflow[None], 1)
+
+    def clear(self):
+        self.count[None] = 0
+        self.overflow[None] = 0
+
+    def drain(self, event_manager: EventManager):
+        count = min(self.count[None], self.capacity)
+        overflow = self.overflow[None]
+        self.clear()
+        self.dropped += overflow
+        if count == 0 and overflow == 0:
+            return
+
+        wanted = [kind for kind, event_type in enumerate(BUFFERED_EVENTS) if event_manager.has_listeners(event_type)]
+        if not wanted:
+            return
+
+        events = {name: column[:count] for name, column in self.events.to_numpy().items()}
+        for kind in wanted:
+            mask = events["kind"] == kind
+            batch = {name: column[mask] for name, column in events.items() if name != "kind"}
+            batch["dropped"] = overflow
+            event_manager.emit(Event(BUFFERED_EVENTS[kind], batch))
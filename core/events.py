@@ -28,6 +28,9 @@ class EventManager:
         if event_type in self._listeners:
             self._listeners[event_type].remove(callback)
 
+    def has_listeners(self, event_type: EventType) -> bool:
+        return bool(self._listeners.get(event_type))
+
     def emit(self, event: Event):
         if event.event_type in self._listeners:
             for callback in self._listeners[event.event_type]:
@@ -0,0 +1,68 @@
+import numpy as np
+import taichi as ti
+
+# Columns of a population view: (name, Creature member, vector component or
+# -1 for scalar members).
+FLOAT_COLUMNS = (
+    ("pos_x", "pos", 0), ("pos_y", "pos", 1),
+    ("vel_x", "vel", 0), ("vel_y", "vel", 1),
+    ("energy", "energy", -1), ("age", "age", -1),
+    ("speed", "speed", -1), ("size", "size", -1),
+    ("vision_range", "vision_range", -1), ("efficiency", "efficiency", -1),
+    ("color_r", "color", 0), ("color_g", "color", 1), ("color_b", "color", 2),
+    ("wander_dir", "wander_dir", -1),
+)
+INT_COLUMNS = (
+    ("generation", "generation", -1),
+    ("wander_steps", "wander_steps", -1),
+)
+
+
+# Host copy of every living creature, one row per creature, in preallocated
+# column buffers that are reused on every collect(). A single kernel gathers
+# the live rows straight into the buffers, so a view costs one pass over the
+# population and no allocation; on GPU backends each buffer is one bulk
+# transfer. The arrays collect() returns are views of those buffers and are
+# overwritten by the next call, so copy them to keep them.
+@ti.data_oriented
+class PopulationView:
+    def __init__(self, simulation):
+        self.simulation = simulation
+        capacity = simulation.config.num_worlds * simulation.config.max_creatures
+        creatures = simulation.creatures
+        self.float_sources = [(getattr(creatures, member), component) for _, member, component in FLOAT_COLUMNS]
+        self.int_sources = [(getattr(creatures, member), component) for _, member, component in INT_COLUMNS]
+
+        # Column-major, so every column is contiguous.
+        self.floats = np.zeros((len(FLOAT_COLUMNS), capacity), dtype=np.float32)
+        self.ints = np.zeros((len(INT_COLUMNS) + 2, capacity), dtype=np.int32)
+
+    def collect(self) -> dict:
+        n = self._gather(self.floats, self.ints)
+        columns = {"world": self.ints[0, :n], "slot": self.ints[1, :n]}
+        columns.update({name: self.floats[j, :n] for j, (name, _, _) in enumerate(FLOAT_COLUMNS)})
+        columns.update({name: self.ints[j + 2, :n] for j, (name, _, _) in enumerate(INT_COLUMNS)})
+        return columns
+
+    @ti.func
+    def _read(self, field: ti.template(), component: ti.template(), w: ti.i32, i: ti.i32):
+        if ti.static(component < 0):
+            return field[w, i]
+        else:
+            return field[w, i][component]
+
+    @ti.kernel
+    def _gather(self, floats: ti.types.ndarray(dtype=ti.f32, ndim=2),
+                ints: ti.types.ndarray(dtype=ti.i32, ndim=2)) -> ti.i32:
+        cur = self.simulation.active_buffer[None]
+        n = self.simulation.live_count[cur]
+        for k in range(n):
+            entry = self.simulation._creature_entry(self.simulation.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            ints[0, k] = w
+            ints[1, k] = i
+            for j in ti.static(range(len(FLOAT_COLUMNS))):
+                floats[j, k] = self._read(self.float_sources[j][0], self.float_sources[j][1], w, i)
+            for j in ti.static(range(len(INT_COLUMNS))):
+                ints[j + 2, k] = self._read(self.int_sources[j][0], self.int_sources[j][1], w, i)
+        return n
@@ -0,0 +1,55 @@
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import taichi as ti
+
+
+# Wall-clock timers for named sections: simulation phases, frame stages. Each
+# section ends with ti.sync() so device work is charged to the section that
+# launched it, which costs some overlap and is why profiling is opt-in. The
+# last `window` samples per section feed summary(); every section is also
+# kept (up to `trace_limit`) for a Chrome trace that chrome://tracing or
+# Perfetto can open.
+class Profiler:
+    def __init__(self, window: int = 120, trace_limit: int = 200000, kernel_profiler: bool = False):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.trace = deque(maxlen=trace_limit)
+        self.kernel_profiler = kernel_profiler
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ti.sync()
+            end = time.perf_counter()
+            self.samples[name].append(end - start)
+            self.trace.append((name, start, end))
+
+    def summary(self) -> dict:
+        return {
+            name: {
+                "mean_ms": sum(samples) / len(samples) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+            for name, samples in self.samples.items() if samples
+        }
+
+    def report(self):
+        for name, timing in self.summary().items():
+            print(f"  {name:<12} mean {timing['mean_ms']:8.3f}ms  max {timing['max_ms']:8.3f}ms")
+        # Per-kernel device times from Taichi, when ti.init(kernel_profiler=True).
+        if self.kernel_profiler:
+            ti.profiler.print_kernel_profiler_info("count")
+
+    def dump_trace(self, path: str):
+        events = [
+            {"name": name, "ph": "X", "pid": 0, "tid": 0,
+             "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+            for name, start, end in self.trace
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
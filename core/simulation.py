@@ -1,24 +1,113 @@
+import numpy as np
 import taichi as ti
 from core.entities import Creature, Food
-from core.config import (
-    WIDTH, HEIGHT, MAX_CREATURES, MAX_FOOD,
-    INITIAL_CREATURES, INITIAL_FOOD, FOOD_SPAWN_RATE,
-    MUTATION_STRENGTH, GRID_WIDTH, GRID_HEIGHT,
-    GRID_CELL_SIZE, MAX_ITEMS_PER_CELL
-)
+from core.config import SimulationConfig, DT, INITIAL_SIZE_RANGE, INITIAL_VISION_RANGE
 from core.events import EventManager, Event, EventType
+from core.spatial import SpatialGrid
+from core.checkpoint import write_checkpoint, read_checkpoint
+from core.event_buffer import EventBuffer, CREATURE_BORN, CREATURE_DIED, FOOD_EATEN, FOOD_SPAWNED
+
+# Independent counter-based random streams, one per kind of draw site.
+RNG_CREATURE, RNG_FOOD, RNG_FOOD_ROLL, RNG_STEER, RNG_BIRTH = range(5)
+
+def _mix32(x: int) -> int:
+    # Host copy of Simulation._hash.
+    x &= 0xFFFFFFFF
+    x ^= x >> 16
+    x = (x * 0x7FEB352D) & 0xFFFFFFFF
+    x ^= x >> 15
+    x = (x * 0x846CA68B) & 0xFFFFFFFF
+    x ^= x >> 16
+    return x
+
+def world_seed(seed: int, world: int) -> int:
+    # Default seed of one world of an ensemble run with config.seed = seed.
+    return _mix32(_mix32(seed) ^ world)
+
+def checkpoint_config(path: str) -> dict:
+    meta, _ = read_checkpoint(path)
+    return meta["config"]
 
 @ti.data_oriented
 class Simulation:
-    def __init__(self, event_manager: EventManager):
+    def __init__(self, event_manager: EventManager, config: SimulationConfig = None):
         self.event_manager = event_manager
-        self.creatures = Creature.field(shape=MAX_CREATURES)
-        self.food = Food.field(shape=MAX_FOOD)
-        self.total_alive = ti.field(dtype=ti.i32, shape=())
-        self.max_generation = ti.field(dtype=ti.i32, shape=())
+        self.config = config or SimulationConfig()
+        config = self.config
+        worlds = config.num_worlds
+
+        # Every per-entity field and counter has a leading world dimension so
+        # one launch of _update_all advances all worlds of an ensemble.
+        layout = ti.Layout.SOA if config.soa_layout else ti.Layout.AOS
+        self.creatures = Creature.field(shape=(worlds, config.max_creatures), layout=layout)
+        self.food = Food.field(shape=(worlds, config.max_food), layout=layout)
+        self.total_alive = ti.field(dtype=ti.i32, shape=worlds)
+        self.max_generation = ti.field(dtype=ti.i32, shape=worlds)
+
+        # Tunable parameters live in device fields so they can change between
+        # ticks without recompiling the kernels that read them.
+        self.mutation_rate = ti.field(dtype=ti.f32, shape=worlds)
+        self.mutation_strength = ti.field(dtype=ti.f32, shape=worlds)
+        self.food_spawn_rate = ti.field(dtype=ti.f32, shape=worlds)
+        self.max_food = ti.field(dtype=ti.i32, shape=worlds)
+        self.separation_strength = ti.field(dtype=ti.f32, shape=worlds)
+        self.set_params(
+            mutation_rate=config.mutation_rate,
+            mutation_strength=config.mutation_strength,
+            food_spawn_rate=config.food_spawn_rate,
+            max_food=config.max_food,
+            separation_strength=config.separation_strength
+        )
 
-        self.food_grid = ti.field(dtype=ti.i32, shape=(GRID_WIDTH, GRID_HEIGHT, MAX_ITEMS_PER_CELL))
-        self.food_grid_count = ti.field(dtype=ti.i32, shape=(GRID_WIDTH, GRID_HEIGHT))
+        self.food_grid = SpatialGrid(config, config.max_food)
+        self.creature_grid = SpatialGrid(config, config.max_creatures, config.creature_cell_size)
+
+        # Stack of dead creature slots per world; births pop from the top,
+        # deaths push.
+        self.free_slots = ti.field(dtype=ti.i32, shape=(worlds, config.max_creatures))
+        self.free_count = ti.field(dtype=ti.i32, shape=worlds)
+        self.food_free_slots = ti.field(dtype=ti.i32, shape=(worlds, config.max_food))
+        self.food_free_count = ti.field(dtype=ti.i32, shape=worlds)
+        self.spawn_count = ti.field(dtype=ti.i32, shape=worlds)
+
+        # Birth tickets across all worlds; each records the parent and its
+        # rank among the parents of its own world.
+        self.birth_parents = ti.field(dtype=ti.i32, shape=worlds * config.max_creatures)
+        self.birth_rank = ti.field(dtype=ti.i32, shape=worlds * config.max_creatures)
+        self.birth_total = ti.field(dtype=ti.i32, shape=())
+        self.birth_count = ti.field(dtype=ti.i32, shape=worlds)
+
+        # Food a creature is close enough to eat this tick. Competing eaters
+        # claim it with atomic_min on Food.claimed_by and the lowest id wins,
+        # whatever order the threads ran in.
+        self.eat_target = ti.field(dtype=ti.i32, shape=(worlds, config.max_creatures))
+
+        # Dense, double-buffered indices of living creatures and active food
+        # across all worlds, packed as world * capacity + slot. Each tick reads
+        # row `active_buffer` and writes the other row, so per-tick loops scale
+        # with the population instead of the capacity.
+        self.live_ids = ti.field(dtype=ti.i32, shape=(2, worlds * config.max_creatures))
+        self.live_count = ti.field(dtype=ti.i32, shape=2)
+        self.food_ids = ti.field(dtype=ti.i32, shape=(2, worlds * config.max_food))
+        self.food_count = ti.field(dtype=ti.i32, shape=2)
+        self.active_buffer = ti.field(dtype=ti.i32, shape=())
+        self.world_food_count = ti.field(dtype=ti.i32, shape=worlds)
+
+        # In deterministic mode every draw of world w hashes seeds[w], never
+        # the world index, so a world can be seeded on its own, or replayed
+        # as a one-world run given its seed and parameters.
+        self.deterministic = bool(config.deterministic)
+        self.seeds = ti.field(dtype=ti.u32, shape=worlds)
+        self.seeds.from_numpy(np.array([world_seed(config.seed, w) for w in range(worlds)], dtype=np.uint32))
+
+        self.record_events = config.event_capacity > 0
+        self.events = EventBuffer(config.event_capacity) if self.record_events else None
+
+        self.tick = 0
+        # Set to a core.profiler.Profiler to run and time the update phase by
+        # phase instead of as one fused kernel.
+        self.profiler = None
+        self.population = None
 
     def initialize(self):
         self._init_simulation()
@@ -26,212 +115,620 @@ class Simulation:
 
     def reset(self):
         self._reset_simulation()
+        self.tick = 0
+        if self.events is not None:
+            self.events.clear()
         self.event_manager.emit(Event(EventType.SIMULATION_RESET))
 
+    def _state_fields(self) -> dict:
+        # Everything that carries over between ticks; grids, birth tickets and
+        # eat targets are rebuilt from scratch every tick.
+        return {
+            "creatures": self.creatures,
+            "food": self.food,
+            "total_alive": self.total_alive,
+            "max_generation": self.max_generation,
+            "mutation_rate": self.mutation_rate,
+            "mutation_strength": self.mutation_strength,
+            "food_spawn_rate": self.food_spawn_rate,
+            "max_food": self.max_food,
+            "separation_strength": self.separation_strength,
+            "seeds": self.seeds,
+            "free_slots": self.free_slots,
+            "free_count": self.free_count,
+            "food_free_slots": self.food_free_slots,
+            "food_free_count": self.food_free_count,
+            "live_ids": self.live_ids,
+            "live_count": self.live_count,
+            "food_ids": self.food_ids,
+            "food_count": self.food_count,
+            "active_buffer": self.active_buffer,
+        }
+
+    def snapshot(self):
+        arrays = {}
+        for name, field in self._state_fields().items():
+            data = field.to_numpy()
+            if isinstance(data, dict):
+                arrays.update({f"{name}.{member}": array for member, array in data.items()})
+            else:
+                arrays[name] = data
+        meta = {"tick": self.tick, "config": self.config.to_dict()}
+        return meta, arrays
+
+    def population_view(self) -> dict:
+        # Living creatures as NumPy columns (world, slot, pos_x, ..., see
+        # core.population), ready for pandas.DataFrame. The arrays are reused
+        # by the next call.
+        if self.population is None:
+            from core.population import PopulationView
+
+            self.population = PopulationView(self)
+        return self.population.collect()
+
+    def save_checkpoint(self, path: str):
+        write_checkpoint(path, *self.snapshot())
+
+    def load_checkpoint(self, path: str):
+        meta, arrays = read_checkpoint(path)
+        if SimulationConfig.from_dict(meta["config"]) != self.config:
+            raise ValueError(f"{path} was saved with a different config; build the Simulation from "
+                             "SimulationConfig.from_dict(checkpoint_config(path)) instead")
+
+        for name, field in self._state_fields().items():
+            members = {key.split(".", 1)[1]: array for key, array in arrays.items() if key.startswith(f"{name}.")}
+            if members:
+                field.from_numpy(members)
+            elif name in arrays:
+                field.from_numpy(arrays[name])
+        self.tick = meta["tick"]
+        if self.events is not None:
+            self.events.clear()
+
+    def set_params(self, world: int = None, mutation_rate: float = None, mutation_strength: float = None,
+                   food_spawn_rate: float = None, max_food: int = None,
+                   separation_strength: float = None, seed: int = None):
+        if max_food is not None:
+            max_food = max(0, min(int(max_food), self.config.max_food))
+        values = {
+            "mutation_rate": mutation_rate,
+            "mutation_strength": mutation_strength,
+            "food_spawn_rate": food_spawn_rate,
+            "max_food": max_food,
+            "separation_strength": separation_strength,
+            "seeds": None if seed is None else seed & 0xFFFFFFFF,
+        }
+        for name, value in values.items():
+            if value is None:
+                continue
+            if world is None and name == "seeds":
+                # Same per-world seeds as a run built with config.seed = seed.
+                self.seeds.from_numpy(np.array([world_seed(value, w) for w in range(self.config.num_worlds)],
+                                               dtype=np.uint32))
+            elif world is None:
+                getattr(self, name).fill(value)
+            else:
+                getattr(self, name)[world] = value
+
+    def get_params(self, world: int = 0) -> dict:
+        return {
+            "mutation_rate": self.mutation_rate[world],
+            "mutation_strength": self.mutation_strength[world],
+            "food_spawn_rate": self.food_spawn_rate[world],
+            "max_food": self.max_food[world],
+            "separation_strength": self.separation_strength[world],
+            "seed": int(self.seeds[world]),
+        }
+
     def update(self, dt: float, should_reproduce: bool):
-        self._update_all(dt, should_reproduce)
+        if self.profiler is None:
+            self._update_all(dt, should_reproduce, self.tick)
+        else:
+            self._update_phases(dt, should_reproduce)
+        self._advance(1)
+
+    def _advance(self, ticks: int):
+        interval = self.config.event_drain_interval
+        previous = self.tick
+        self.tick += ticks
+        if self.tick // interval != previous // interval:
+            self.drain_events()
+
+    def drain_events(self):
+        # Delivers the events recorded since the last drain, e.g. at the end
+        # of a run that stopped between two event_drain_interval boundaries.
+        if self.events is not None:
+            self.events.drain(self.event_manager)
+
+    def reproduce_every(self, dt: float) -> int:
+        return max(1, round(self.config.reproduction_period / dt))
+
+    def _update_phases(self, dt: float, should_reproduce: bool):
+        with self.profiler.section("food"):
+            self._run_food_phase(self.tick)
+        with self.profiler.section("grid"):
+            self._run_grid_phase()
+        with self.profiler.section("steer"):
+            self._run_steer_phase(dt, self.tick)
+        with self.profiler.section("eat"):
+            self._run_eat_phase(self.tick)
+        with self.profiler.section("death"):
+            self._run_death_phase(self.tick)
+        with self.profiler.section("reproduce"):
+            self._run_reproduce_phase(should_reproduce, self.tick)
+
+    def step(self, n: int = 1, dt: float = DT):
+        every = self.reproduce_every(dt)
+        fused = self.config.ticks_per_launch
+        end = self.tick + n
+        while self.tick < end:
+            if fused > 1 and self.profiler is None and end - self.tick >= fused:
+                self._update_fused(dt, self.tick, every)
+                self._advance(fused)
+            else:
+                self.update(dt, 1 if self.tick % every == 0 else 0)
+
+    @ti.func
+    def _record(self, kind: ti.i32, tick: ti.i32, world: ti.i32, entity: ti.i32, other: ti.i32, value: ti.f32):
+        if ti.static(self.record_events):
+            self.events.push(kind, tick, world, entity, other, value)
+
+    @ti.func
+    def _hash(self, x: ti.u32) -> ti.u32:
+        x ^= x >> 16
+        x *= ti.u32(0x7FEB352D)
+        x ^= x >> 15
+        x *= ti.u32(0x846CA68B)
+        x ^= x >> 16
+        return x
+
+    @ti.func
+    def _rng_key(self, stream: ti.i32, w: ti.i32, tick: ti.i32, entity: ti.i32) -> ti.u32:
+        key = self._hash(self.seeds[w] ^ ti.cast(stream, ti.u32))
+        key = self._hash(key ^ ti.cast(tick, ti.u32))
+        return self._hash(key ^ ti.cast(entity, ti.u32))
+
+    @ti.func
+    def _random(self, key: ti.u32, draw: ti.i32) -> ti.f32:
+        # Deterministic draws depend only on the key and the draw index, never
+        # on which thread got there first; otherwise use Taichi's fast RNG.
+        result = 0.0
+        if ti.static(self.deterministic):
+            bits = self._hash(key + ti.cast(draw, ti.u32) * ti.u32(0x9E3779B9))
+            result = ti.cast(bits >> 8, ti.f32) * (1.0 / 16777216.0)
+        else:
+            result = ti.random()
+        return result
+
+    @ti.func
+    def _creature_entry(self, entry: ti.i32) -> ti.math.ivec2:
+        return ti.math.ivec2(entry // self.config.max_creatures, entry % self.config.max_creatures)
+
+    @ti.func
+    def _food_entry(self, entry: ti.i32) -> ti.math.ivec2:
+        return ti.math.ivec2(entry // self.config.max_food, entry % self.config.max_food)
 
     @ti.kernel
     def _init_simulation(self):
-        for i in range(INITIAL_CREATURES):
-            self._set_creature(i, alive=1)
+        for w, i in ti.ndrange(self.config.num_worlds, self.config.initial_creatures):
+            self._set_creature(w, i, alive=1)
+            self.live_ids[0, w * self.config.initial_creatures + i] = w * self.config.max_creatures + i
 
-        for i in range(INITIAL_FOOD):
-            self.food[i].pos = ti.math.vec2(
-                ti.random() * WIDTH,
-                ti.random() * HEIGHT
-            )
-            self.food[i].energy = 10.0 + ti.random() * 20.0
-            self.food[i].active = 1
+        for w, i in ti.ndrange(self.config.num_worlds, self.config.initial_food):
+            self._spawn_food(w, i, 0)
+            self.food_ids[0, w * self.config.initial_food + i] = w * self.config.max_food + i
+
+        self.active_buffer[None] = 0
+        self.live_count[0] = self.config.num_worlds * self.config.initial_creatures
+        self.food_count[0] = self.config.num_worlds * self.config.initial_food
+
+        for w in range(self.config.num_worlds):
+            self.total_alive[w] = self.config.initial_creatures
+            self.free_count[w] = self.config.max_creatures - self.config.initial_creatures
+            self.food_free_count[w] = self.config.max_food - self.config.initial_food
+
+        for w, k in ti.ndrange(self.config.num_worlds, self.config.max_creatures - self.config.initial_creatures):
+            self.free_slots[w, k] = self.config.max_creatures - 1 - k
+
+        for w, k in ti.ndrange(self.config.num_worlds, self.config.max_food - self.config.initial_food):
+            self.food_free_slots[w, k] = self.config.max_food - 1 - k
 
     @ti.func
-    def _world_to_grid(self, pos: ti.math.vec2) -> ti.math.ivec2:
-        grid_x = ti.cast(pos.x / GRID_CELL_SIZE, ti.i32)
-        grid_y = ti.cast(pos.y / GRID_CELL_SIZE, ti.i32)
-        grid_x = ti.math.clamp(grid_x, 0, GRID_WIDTH - 1)
-        grid_y = ti.math.clamp(grid_y, 0, GRID_HEIGHT - 1)
-        return ti.math.ivec2(grid_x, grid_y)
+    def _spawn_food(self, w: ti.i32, i: ti.i32, tick: ti.i32):
+        key = self._rng_key(RNG_FOOD, w, tick, i)
+        self.food[w, i].pos = ti.math.vec2(
+            self._random(key, 0) * self.config.width,
+            self._random(key, 1) * self.config.height
+        )
+        self.food[w, i].energy = 10.0 + self._random(key, 2) * 20.0
+        self.food[w, i].active = 1
 
     @ti.func
     def _wrap_position(self, pos: ti.math.vec2) -> ti.math.vec2:
-        result = pos
-        if result.x < 0:
-            result.x = WIDTH
-        elif result.x > WIDTH:
-            result.x = 0
-        if result.y < 0:
-            result.y = HEIGHT
-        elif result.y > HEIGHT:
-            result.y = 0
+        # Torus wrap into [0, size), however far past an edge pos has moved.
+        size = ti.math.vec2(self.config.width, self.config.height)
+        result = pos - size * ti.floor(pos / size)
+        # Rounding can land a tiny negative coordinate exactly on size.
+        if result.x >= size.x:
+            result.x = 0.0
+        if result.y >= size.y:
+            result.y = 0.0
         return result
 
     @ti.func
-    def _mutate_value(self, value: ti.f32, min_val: ti.f32, max_val: ti.f32) -> ti.f32:
-        mutation = 1.0 + (ti.random() - 0.5) * MUTATION_STRENGTH
+    def _mutate_value(self, w: ti.i32, key: ti.u32, draw: ti.i32, value: ti.f32,
+                      min_val: ti.f32, max_val: ti.f32) -> ti.f32:
+        mutation = 1.0
+        if self._random(key, draw) < self.mutation_rate[w]:
+            mutation += (self._random(key, draw + 1) - 0.5) * self.mutation_strength[w]
         return ti.math.clamp(value * mutation, min_val, max_val)
 
     @ti.func
-    def _find_nearest_food(self, creature_pos: ti.math.vec2, vision_range: ti.f32) -> ti.i32:
+    def _find_nearest_food(self, w: ti.i32, creature_pos: ti.math.vec2, vision_range: ti.f32) -> ti.i32:
         nearest_food = -1
         min_dist_sq = vision_range * vision_range
 
-        creature_grid_pos = self._world_to_grid(creature_pos)
-        search_radius = ti.cast(vision_range / GRID_CELL_SIZE, ti.i32) + 1
-
-        for dx in range(-search_radius, search_radius + 1):
-            for dy in range(-search_radius, search_radius + 1):
-                check_x = creature_grid_pos.x + dx
-                check_y = creature_grid_pos.y + dy
+        cells = self.food_grid.cells_within(creature_pos, vision_range)
 
-                if 0 <= check_x < GRID_WIDTH and 0 <= check_y < GRID_HEIGHT:
-                    cell_count = self.food_grid_count[check_x, check_y]
-                    for idx in range(cell_count):
-                        j = self.food_grid[check_x, check_y, idx]
-                        if self.food[j].active == 1:
-                            dist_sq = ti.math.distance(creature_pos, self.food[j].pos)
-                            dist_sq = dist_sq * dist_sq
+        for check_x in range(cells[0], cells[2] + 1):
+            for check_y in range(cells[1], cells[3] + 1):
+                span = self.food_grid.cell_range(w, check_x, check_y)
+                for slot in range(span[0], span[1]):
+                    offset = self.food_grid.item_pos[slot] - creature_pos
+                    dist_sq = offset.dot(offset)
 
-                            if dist_sq < min_dist_sq:
-                                min_dist_sq = dist_sq
-                                nearest_food = j
+                    if dist_sq < min_dist_sq:
+                        min_dist_sq = dist_sq
+                        nearest_food = self.food_grid.items[slot]
 
         return nearest_food
 
     @ti.func
-    def _set_creature(self, i: int, alive: ti.i32):
-        self.creatures[i].pos = ti.math.vec2(
-            ti.random() * WIDTH,
-            ti.random() * HEIGHT
+    def _separation_push(self, push: ti.math.vec2, w: ti.i32, owner: ti.i32, other: ti.i32,
+                         other_pos: ti.math.vec2) -> ti.math.vec2:
+        result = push
+        if other != owner:
+            offset = self.creatures[w, owner].pos - other_pos
+            dist = offset.norm()
+            overlap = self.creatures[w, owner].size + self.creatures[w, other].size - dist
+            if overlap > 0 and dist > 1e-6:
+                # Each side of an overlapping pair moves half the overlap apart.
+                result += offset / dist * overlap * 0.5
+        return result
+
+    @ti.func
+    def _set_creature(self, w: ti.i32, i: ti.i32, alive: ti.i32):
+        key = self._rng_key(RNG_CREATURE, w, 0, i)
+        self.creatures[w, i].pos = ti.math.vec2(
+            self._random(key, 0) * self.config.width,
+            self._random(key, 1) * self.config.height
         )
-        self.creatures[i].vel = ti.math.vec2(0, 0)
-        self.creatures[i].energy = 50.0
-        self.creatures[i].age = 0.0
-        self.creatures[i].alive = alive
-        self.creatures[i].speed = 1.0 + ti.random() * 0.4
-        self.creatures[i].size = 3.0 + ti.random() * 4.0
-        self.creatures[i].vision_range = 35.0 + ti.random() * 40.0
-        self.creatures[i].efficiency = 0.8 + ti.random() * 0.4
-        self.creatures[i].color = ti.math.vec3(
-            0.2 + ti.random() * 0.8,
-            0.2 + ti.random() * 0.8,
-            0.2 + ti.random() * 0.8
+        self.creatures[w, i].vel = ti.math.vec2(0, 0)
+        self.creatures[w, i].energy = 50.0
+        self.creatures[w, i].age = 0.0
+        self.creatures[w, i].alive = alive
+        self.creatures[w, i].speed = 1.0 + self._random(key, 2) * 0.4
+        self.creatures[w, i].size = INITIAL_SIZE_RANGE[0] + self._random(key, 3) * (
+            INITIAL_SIZE_RANGE[1] - INITIAL_SIZE_RANGE[0])
+        self.creatures[w, i].vision_range = INITIAL_VISION_RANGE[0] + self._random(key, 4) * (
+            INITIAL_VISION_RANGE[1] - INITIAL_VISION_RANGE[0])
+        self.creatures[w, i].efficiency = 0.8 + self._random(key, 5) * 0.4
+        self.creatures[w, i].color = ti.math.vec3(
+            0.2 + self._random(key, 6) * 0.8,
+            0.2 + self._random(key, 7) * 0.8,
+            0.2 + self._random(key, 8) * 0.8
         )
-        self.creatures[i].generation = 0
-        self.creatures[i].wander_dir = ti.random() * 2.0 * 3.14159
-        self.creatures[i].wander_steps = 0
+        self.creatures[w, i].generation = 0
+        self.creatures[w, i].wander_dir = self._random(key, 9) * 2.0 * 3.14159
+        self.creatures[w, i].wander_steps = 0
 
     @ti.kernel
     def _reset_simulation(self):
-        for i in range(MAX_CREATURES):
-            self._set_creature(i, alive=0)
+        for w, i in ti.ndrange(self.config.num_worlds, self.config.max_creatures):
+            self._set_creature(w, i, alive=0)
+
+        for w, i in ti.ndrange(self.config.num_worlds, self.config.max_food):
+            self.food[w, i].active = 0
+
+        for w in range(self.config.num_worlds):
+            self.total_alive[w] = 0
+            self.max_generation[w] = 0
+            self.free_count[w] = 0
+            self.food_free_count[w] = 0
+
+        self.birth_total[None] = 0
+        self.active_buffer[None] = 0
+        for b in range(2):
+            self.live_count[b] = 0
+            self.food_count[b] = 0
+
+    @ti.func
+    def _spawn_child(self, w: ti.i32, parent: ti.i32, child: ti.i32, tick: ti.i32):
+        key = self._rng_key(RNG_BIRTH, w, tick, child)
+        self.creatures[w, child].pos = self.creatures[w, parent].pos + ti.math.vec2(
+            self._random(key, 0) * 20 - 10,
+            self._random(key, 1) * 20 - 10
+        )
+        self.creatures[w, child].vel = ti.math.vec2(0, 0)
+        self.creatures[w, child].energy = 30.0
+        self.creatures[w, child].age = 0.0
+        self.creatures[w, child].alive = 1
+        self.creatures[w, child].generation = self.creatures[w, parent].generation + 1
+        self.creatures[w, child].wander_dir = self._random(key, 2) * 2.0 * 3.14159
+        self.creatures[w, child].wander_steps = 0
+
+        self.creatures[w, child].speed = self._mutate_value(w, key, 3, self.creatures[w, parent].speed, 0.1, 3.0)
+        self.creatures[w, child].size = self._mutate_value(
+            w, key, 5, self.creatures[w, parent].size, 1.0, self.config.max_creature_size)
+        self.creatures[w, child].vision_range = self._mutate_value(
+            w, key, 7, self.creatures[w, parent].vision_range, 10.0, self.config.max_vision_range)
+        self.creatures[w, child].efficiency = self._mutate_value(
+            w, key, 9, self.creatures[w, parent].efficiency, 0.2, 2.0)
+
+        self.creatures[w, child].color = ti.math.clamp(
+            self.creatures[w, parent].color + ti.math.vec3(
+                (self._random(key, 11) - 0.5) * 0.1,
+                (self._random(key, 12) - 0.5) * 0.1,
+                (self._random(key, 13) - 0.5) * 0.1
+            ),
+            0.0, 1.0
+        )
+
+        self.creatures[w, parent].energy -= 40.0
+        ti.atomic_max(self.max_generation[w], self.creatures[w, child].generation)
 
-        for i in range(MAX_FOOD):
-            self.food[i].active = 0
+    @ti.kernel
+    def _update_all(self, dt: ti.f32, should_reproduce: ti.i32, tick: ti.i32):
+        self._food_phase(tick)
+        self._grid_phase()
+        self._steer_phase(dt, tick)
+        self._eat_phase(tick)
+        self._death_phase(tick)
+        self._reproduce_phase(should_reproduce, tick)
+
+    @ti.kernel
+    def _update_fused(self, dt: ti.f32, tick: ti.i32, reproduce_every: ti.i32):
+        # ticks_per_launch whole ticks, unrolled at compile time so every
+        # phase loop stays a top-level parallel loop.
+        for s in ti.static(range(self.config.ticks_per_launch)):
+            should_reproduce = ti.cast((tick + s) % reproduce_every == 0, ti.i32)
+            self._food_phase(tick + s)
+            self._grid_phase()
+            self._steer_phase(dt, tick + s)
+            self._eat_phase(tick + s)
+            self._death_phase(tick + s)
+            self._reproduce_phase(should_reproduce, tick + s)
+
+    # One kernel per phase, launched instead of _update_all while profiling so
+    # each phase shows up under its own name in the timings.
+    @ti.kernel
+    def _run_food_phase(self, tick: ti.i32):
+        self._food_phase(tick)
 
-        self.total_alive[None] = 0
-        self.max_generation[None] = 0
+    @ti.kernel
+    def _run_grid_phase(self):
+        self._grid_phase()
+
+    @ti.kernel
+    def _run_steer_phase(self, dt: ti.f32, tick: ti.i32):
+        self._steer_phase(dt, tick)
+
+    @ti.kernel
+    def _run_eat_phase(self, tick: ti.i32):
+        self._eat_phase(tick)
+
+    @ti.kernel
+    def _run_death_phase(self, tick: ti.i32):
+        self._death_phase(tick)
 
     @ti.kernel
-    def _update_all(self, dt: ti.f32, should_reproduce: ti.i32):
-        for i, j in ti.ndrange(GRID_WIDTH, GRID_HEIGHT):
-            self.food_grid_count[i, j] = 0
-
-        for i in range(MAX_FOOD):
-            if self.food[i].active == 0:
-                if ti.random() < FOOD_SPAWN_RATE:
-                    self.food[i].pos = ti.math.vec2(
-                        ti.random() * WIDTH,
-                        ti.random() * HEIGHT
-                    )
-                    self.food[i].energy = 10.0 + ti.random() * 20.0
-                    self.food[i].active = 1
-
-            if self.food[i].active == 1:
-                grid_pos = self._world_to_grid(self.food[i].pos)
-                count = ti.atomic_add(self.food_grid_count[grid_pos.x, grid_pos.y], 1)
-                if count < MAX_ITEMS_PER_CELL:
-                    self.food_grid[grid_pos.x, grid_pos.y, count] = i
-
-        self.total_alive[None] = 0
-        max_gen = 0
-
-        for i in range(MAX_CREATURES):
-            if self.creatures[i].alive == 1:
-                self.total_alive[None] += 1
-                max_gen = ti.max(max_gen, self.creatures[i].generation)
-
-                self.creatures[i].age += dt
-                energy_cost = dt * (0.5 + self.creatures[i].speed * 0.8 +
-                                    self.creatures[i].size * 0.8 +
-                                    self.creatures[i].vision_range * 0.01) / self.creatures[i].efficiency
-                self.creatures[i].energy -= energy_cost
-
-                nearest_food = self._find_nearest_food(self.creatures[i].pos, self.creatures[i].vision_range)
-                eating_range_sq = (self.creatures[i].size + 5) * (self.creatures[i].size + 5)
-
-                if nearest_food >= 0:
-                    direction = ti.math.normalize(self.food[nearest_food].pos - self.creatures[i].pos)
-                    self.creatures[i].vel = direction * self.creatures[i].speed * 50.0
-                    self.creatures[i].wander_steps = 0
-                else:
-                    if self.creatures[i].wander_steps <= 0:
-                        self.creatures[i].wander_dir = ti.random() * 2.0 * 3.14159
-                        self.creatures[i].wander_steps = ti.cast(10 + ti.random() * 20, ti.i32)
-
-                    angle_variation = (ti.random() - 0.5) * 0.2
-                    current_angle = self.creatures[i].wander_dir + angle_variation
-                    self.creatures[i].vel = ti.math.vec2(
-                        ti.cos(current_angle) * self.creatures[i].speed * 30.0,
-                        ti.sin(current_angle) * self.creatures[i].speed * 30.0
-                    )
-                    self.creatures[i].wander_steps -= 1
-
-                self.creatures[i].pos = self._wrap_position(self.creatures[i].pos + self.creatures[i].vel * dt)
-
-                if nearest_food >= 0:
-                    dist_sq = ti.math.distance(self.creatures[i].pos, self.food[nearest_food].pos)
-                    dist_sq = dist_sq * dist_sq
-                    if dist_sq < eating_range_sq:
-                        self.creatures[i].energy += self.food[nearest_food].energy
-                        self.food[nearest_food].active = 0
-
-                if self.creatures[i].energy <= 0 or self.creatures[i].age > 80:
-                    self.creatures[i].alive = 0
-                    self.total_alive[None] -= 1
-
-        self.max_generation[None] = max_gen
-
-        if should_reproduce == 1:
-            for i in range(MAX_CREATURES):
-                if self.creatures[i].alive == 1 and self.creatures[i].energy > 80:
-                    for j in range(MAX_CREATURES):
-                        if self.creatures[j].alive == 0:
-                            self.creatures[j].pos = self.creatures[i].pos + ti.math.vec2(
-                                ti.random() * 20 - 10,
-                                ti.random() * 20 - 10
-                            )
-                            self.creatures[j].vel = ti.math.vec2(0, 0)
-                            self.creatures[j].energy = 30.0
-                            self.creatures[j].age = 0.0
-                            self.creatures[j].alive = 1
-                            self.creatures[j].generation = self.creatures[i].generation + 1
-                            self.creatures[j].wander_dir = ti.random() * 2.0 * 3.14159
-                            self.creatures[j].wander_steps = 0
-
-                            self.creatures[j].speed = self._mutate_value(self.creatures[i].speed, 0.1, 3.0)
-                            self.creatures[j].size = self._mutate_value(self.creatures[i].size, 1.0, 15.0)
-                            self.creatures[j].vision_range = self._mutate_value(self.creatures[i].vision_range, 10.0, 150.0)
-                            self.creatures[j].efficiency = self._mutate_value(self.creatures[i].efficiency, 0.2, 2.0)
-
-                            self.creatures[j].color = ti.math.clamp(
-                                self.creatures[i].color + ti.math.vec3(
-                                    (ti.random() - 0.5) * 0.1,
-                                    (ti.random() - 0.5) * 0.1,
-                                    (ti.random() - 0.5) * 0.1
-                                ),
-                                0.0, 1.0
-                            )
-
-                            self.creatures[i].energy -= 40.0
-                            break
+    def _run_reproduce_phase(self, should_reproduce: ti.i32, tick: ti.i32):
+        self._reproduce_phase(should_reproduce, tick)
 
+    @ti.func
+    def _food_phase(self, tick: ti.i32):
+        cur = self.active_buffer[None]
+        nxt = 1 - cur
+
+        # Carry still-active food over to the next index; eaten food goes back
+        # on its world's free stack, then free slots respawn at food_spawn_rate
+        # up to max_food active items per world.
+        self.food_count[nxt] = 0
+        for w in range(self.config.num_worlds):
+            self.spawn_count[w] = 0
+            self.world_food_count[w] = 0
+
+        # In deterministic mode every loop that appends to a list or stack
+        # through an atomic cursor runs serially, so slot assignment and list
+        # order do not depend on thread scheduling.
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(self.food_count[cur]):
+            entry = self._food_entry(self.food_ids[cur, k])
+            w, i = entry[0], entry[1]
+            if self.food[w, i].active == 1:
+                self.food_ids[nxt, ti.atomic_add(self.food_count[nxt], 1)] = self.food_ids[cur, k]
+                self.world_food_count[w] += 1
+            else:
+                self.food_free_slots[w, ti.atomic_add(self.food_free_count[w], 1)] = i
+
+        for w, k in ti.ndrange(self.config.num_worlds, self.config.max_food):
+            if k < self.food_free_count[w] and \
+                    self._random(self._rng_key(RNG_FOOD_ROLL, w, tick, k), 0) < self.food_spawn_rate[w]:
+                self.spawn_count[w] += 1
+
+        for w in range(self.config.num_worlds):
+            self.spawn_count[w] = ti.max(0, ti.min(self.spawn_count[w],
+                                                   self.max_food[w] - self.world_food_count[w]))
+
+        ti.loop_config(serialize=self.deterministic)
+        for w, k in ti.ndrange(self.config.num_worlds, self.config.max_food):
+            if k < self.spawn_count[w]:
+                i = self.food_free_slots[w, self.food_free_count[w] - 1 - k]
+                self._spawn_food(w, i, tick)
+                self.food_ids[nxt, ti.atomic_add(self.food_count[nxt], 1)] = w * self.config.max_food + i
+                self._record(FOOD_SPAWNED, tick, w, i, -1, self.food[w, i].energy)
+
+        for w in range(self.config.num_worlds):
+            self.food_free_count[w] -= self.spawn_count[w]
+
+    @ti.func
+    def _grid_phase(self):
+        cur = self.active_buffer[None]
+        nxt = 1 - cur
+
+        # Food for this tick is already in row nxt; creatures are still in cur.
+        self.food_grid.clear()
+        for k in range(self.food_count[nxt]):
+            entry = self._food_entry(self.food_ids[nxt, k])
+            self.food_grid.count(entry[0], self.food[entry[0], entry[1]].pos)
+        self.food_grid.prefix_sum()
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(self.food_count[nxt]):
+            entry = self._food_entry(self.food_ids[nxt, k])
+            w, i = entry[0], entry[1]
+            self.food_grid.insert(w, self.food[w, i].pos, i)
+            self.food[w, i].claimed_by = self.config.max_creatures
+
+        self.creature_grid.clear()
+        for k in range(self.live_count[cur]):
+            entry = self._creature_entry(self.live_ids[cur, k])
+            self.creature_grid.count(entry[0], self.creatures[entry[0], entry[1]].pos)
+        self.creature_grid.prefix_sum()
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(self.live_count[cur]):
+            entry = self._creature_entry(self.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            self.creature_grid.insert(w, self.creatures[w, i].pos, i)
+
+    @ti.func
+    def _steer_phase(self, dt: ti.f32, tick: ti.i32):
+        cur = self.active_buffer[None]
+        for w in range(self.config.num_worlds):
+            self.max_generation[w] = 0
+
+        for k in range(self.live_count[cur]):
+            entry = self._creature_entry(self.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            ti.atomic_max(self.max_generation[w], self.creatures[w, i].generation)
+
+            self.creatures[w, i].age += dt
+            energy_cost = dt * (0.5 + self.creatures[w, i].speed * 0.8 +
+                                self.creatures[w, i].size * 0.8 +
+                                self.creatures[w, i].vision_range * 0.01) / self.creatures[w, i].efficiency
+            self.creatures[w, i].energy -= energy_cost
+
+            nearest_food = self._find_nearest_food(w, self.creatures[w, i].pos, self.creatures[w, i].vision_range)
+            eating_range_sq = (self.creatures[w, i].size + 5) * (self.creatures[w, i].size + 5)
+
+            if nearest_food >= 0:
+                direction = ti.math.normalize(self.food[w, nearest_food].pos - self.creatures[w, i].pos)
+                self.creatures[w, i].vel = direction * self.creatures[w, i].speed * 50.0
+                self.creatures[w, i].wander_steps = 0
+            else:
+                key = self._rng_key(RNG_STEER, w, tick, i)
+                if self.creatures[w, i].wander_steps <= 0:
+                    self.creatures[w, i].wander_dir = self._random(key, 0) * 2.0 * 3.14159
+                    self.creatures[w, i].wander_steps = ti.cast(10 + self._random(key, 1) * 20, ti.i32)
+
+                angle_variation = (self._random(key, 2) - 0.5) * 0.2
+                current_angle = self.creatures[w, i].wander_dir + angle_variation
+                self.creatures[w, i].vel = ti.math.vec2(
+                    ti.cos(current_angle) * self.creatures[w, i].speed * 30.0,
+                    ti.sin(current_angle) * self.creatures[w, i].speed * 30.0
+                )
+                self.creatures[w, i].wander_steps -= 1
+
+            # Soft-body separation reads the positions captured in the creature
+            # grid, so it never observes a neighbour that already moved.
+            push = self.creature_grid.fold_neighbours(
+                w, self.creatures[w, i].pos, self.creatures[w, i].size + self.config.max_creature_size,
+                i, ti.math.vec2(0.0, 0.0), self._separation_push
+            )
+            push *= self.separation_strength[w]
+
+            self.creatures[w, i].pos = self._wrap_position(
+                self.creatures[w, i].pos + self.creatures[w, i].vel * dt + push)
+
+            self.eat_target[w, i] = -1
+            if nearest_food >= 0:
+                dist_sq = ti.math.distance(self.creatures[w, i].pos, self.food[w, nearest_food].pos)
+                dist_sq = dist_sq * dist_sq
+                if dist_sq < eating_range_sq:
+                    self.eat_target[w, i] = nearest_food
+                    ti.atomic_min(self.food[w, nearest_food].claimed_by, i)
+
+    @ti.func
+    def _eat_phase(self, tick: ti.i32):
+        cur = self.active_buffer[None]
+
+        # Food only changes hands once every claim is in, so each item is eaten
+        # at most once and its energy is counted exactly once.
+        for k in range(self.live_count[cur]):
+            entry = self._creature_entry(self.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            target = self.eat_target[w, i]
+            if target >= 0 and self.food[w, target].claimed_by == i:
+                self.creatures[w, i].energy += self.food[w, target].energy
+                self.food[w, target].active = 0
+                self._record(FOOD_EATEN, tick, w, target, i, self.food[w, target].energy)
+
+    @ti.func
+    def _death_phase(self, tick: ti.i32):
+        cur = self.active_buffer[None]
+        nxt = 1 - cur
+
+        self.live_count[nxt] = 0
+        for w in range(self.config.num_worlds):
+            self.total_alive[w] = 0
+
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(self.live_count[cur]):
+            entry = self._creature_entry(self.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            if self.creatures[w, i].energy <= 0 or self.creatures[w, i].age > 80:
+                self.creatures[w, i].alive = 0
+                slot = ti.atomic_add(self.free_count[w], 1)
+                self.free_slots[w, slot] = i
+                self._record(CREATURE_DIED, tick, w, i, self.creatures[w, i].generation, self.creatures[w, i].age)
+            else:
+                self.live_ids[nxt, ti.atomic_add(self.live_count[nxt], 1)] = self.live_ids[cur, k]
+                self.total_alive[w] += 1
+
+    @ti.func
+    def _reproduce_phase(self, should_reproduce: ti.i32, tick: ti.i32):
+        cur = self.active_buffer[None]
+        nxt = 1 - cur
+
+        self.birth_total[None] = 0
+        for w in range(self.config.num_worlds):
+            self.birth_count[w] = 0
+
+        # Row nxt holds exactly the survivors at this point.
+        survivors = self.live_count[nxt]
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(survivors):
+            entry = self._creature_entry(self.live_ids[nxt, k])
+            w, i = entry[0], entry[1]
+            if should_reproduce == 1 and self.creatures[w, i].energy > 80:
+                ticket = ti.atomic_add(self.birth_total[None], 1)
+                self.birth_parents[ticket] = self.live_ids[nxt, k]
+                self.birth_rank[ticket] = ti.atomic_add(self.birth_count[w], 1)
+
+        # Births take the top of their world's free stack, one slot per ticket,
+        # so no two parents can claim the same child slot.
+        ti.loop_config(serialize=self.deterministic)
+        for k in range(self.birth_total[None]):
+            entry = self._creature_entry(self.birth_parents[k])
+            w, parent = entry[0], entry[1]
+            rank = self.birth_rank[k]
+            if rank < self.free_count[w]:
+                child = self.free_slots[w, self.free_count[w] - 1 - rank]
+                self._spawn_child(w, parent, child, tick)
+                self._record(CREATURE_BORN, tick, w, child, parent, self.creatures[w, child].generation)
+                self.live_ids[nxt, ti.atomic_add(self.live_count[nxt], 1)] = w * self.config.max_creatures + child
+                self.total_alive[w] += 1
+
+        for w in range(self.config.num_worlds):
+            self.free_count[w] -= ti.min(self.birth_count[w], self.free_count[w])
+
+        self.active_buffer[None] = nxt
@@ -0,0 +1,133 @@
+import math
+import taichi as ti
+from core.config import SimulationConfig
+
+
+# Uniform grid stored as a counting-sort (CSR) index, one grid per world:
+# cell (w, x, y) owns items[cell_start[w, x, y] : + cell_count[w, x, y]].
+# A rebuild is clear(), count(world, pos) per item, prefix_sum(), then
+# insert(world, pos, item) per item, each called from the top level of a kernel.
+#
+# With config.grid_chunk_size > 0 the cells live in chunks of that many cells
+# square under a pointer SNode. Counting activates the chunks items land in
+# and lists each occupied cell once; prefix_sum() and the next clear() walk
+# only that list, so memory and per-tick work follow the occupied area rather
+# than the world's bounds. Cells in inactive chunks read as zero, which is an
+# empty range.
+@ti.data_oriented
+class SpatialGrid:
+    def __init__(self, config: SimulationConfig, capacity: int, cell_size: int = None):
+        self.cell_size = cell_size or config.cell_size
+        self.grid_width = (config.width + self.cell_size - 1) // self.cell_size
+        self.grid_height = (config.height + self.cell_size - 1) // self.cell_size
+        self.num_worlds = config.num_worlds
+        self.capacity = capacity
+
+        self.chunk_size = config.grid_chunk_size
+        if self.chunk_size > 0:
+            self.cell_count = ti.field(dtype=ti.i32)
+            self.cell_start = ti.field(dtype=ti.i32)
+            self.chunks = ti.root.pointer(ti.ijk, (self.num_worlds,
+                                                   math.ceil(self.grid_width / self.chunk_size),
+                                                   math.ceil(self.grid_height / self.chunk_size)))
+            self.chunks.dense(ti.ijk, (1, self.chunk_size, self.chunk_size)).place(self.cell_count, self.cell_start)
+            self.occupied = ti.Vector.field(3, dtype=ti.i32, shape=self.num_worlds * capacity)
+            self.occupied_count = ti.field(dtype=ti.i32, shape=())
+        else:
+            shape = (self.num_worlds, self.grid_width, self.grid_height)
+            self.cell_count = ti.field(dtype=ti.i32, shape=shape)
+            self.cell_start = ti.field(dtype=ti.i32, shape=shape)
+        self.items = ti.field(dtype=ti.i32, shape=self.num_worlds * capacity)
+        self.item_pos = ti.Vector.field(2, dtype=ti.f32, shape=self.num_worlds * capacity)
+
+    @ti.func
+    def cell_of(self, pos: ti.math.vec2) -> ti.math.ivec2:
+        grid_x = ti.cast(pos.x / self.cell_size, ti.i32)
+        grid_y = ti.cast(pos.y / self.cell_size, ti.i32)
+        grid_x = ti.math.clamp(grid_x, 0, self.grid_width - 1)
+        grid_y = ti.math.clamp(grid_y, 0, self.grid_height - 1)
+        return ti.math.ivec2(grid_x, grid_y)
+
+    @ti.func
+    def clear(self):
+        if ti.static(self.chunk_size > 0):
+            # Serial, as several listed cells can share a chunk.
+            ti.loop_config(serialize=True)
+            for c in range(self.occupied_count[None]):
+                cell = self.occupied[c]
+                w, x, y = cell[0], cell[1] // self.chunk_size, cell[2] // self.chunk_size
+                if ti.is_active(self.chunks, [w, x, y]):
+                    # ti.deactivate warns about any index it cannot yet see
+                    # is i32, which includes plain local variables.
+                    ti.deactivate(self.chunks, [ti.cast(w, ti.i32), ti.cast(x, ti.i32), ti.cast(y, ti.i32)])
+            self.occupied_count[None] = 0
+        else:
+            for w, i, j in self.cell_count:
+                self.cell_count[w, i, j] = 0
+
+    @ti.func
+    def count(self, world: ti.i32, pos: ti.math.vec2):
+        cell = self.cell_of(pos)
+        previous = ti.atomic_add(self.cell_count[world, cell.x, cell.y], 1)
+        if ti.static(self.chunk_size > 0):
+            if previous == 0:
+                self.occupied[ti.atomic_add(self.occupied_count[None], 1)] = ti.math.ivec3(world, cell.x, cell.y)
+
+    @ti.func
+    def prefix_sum(self):
+        if ti.static(self.chunk_size > 0):
+            # The occupied list is never longer than the item count, so one
+            # serial scan over it is cheap. Ranges follow the list's order
+            # rather than row-major order; queries only rely on each cell's
+            # range being contiguous.
+            total = 0
+            ti.loop_config(serialize=True)
+            for c in range(self.occupied_count[None]):
+                cell = self.occupied[c]
+                self.cell_start[cell] = total
+                total += self.cell_count[cell]
+                self.cell_count[cell] = 0
+        else:
+            # A world never holds more than `capacity` items, so each world's
+            # ranges start at w * capacity and the worlds scan in parallel,
+            # each walking its own cells in row-major order.
+            for w in range(self.num_worlds):
+                total = w * self.capacity
+                for i in range(self.grid_width):
+                    for j in range(self.grid_height):
+                        self.cell_start[w, i, j] = total
+                        total += self.cell_count[w, i, j]
+                        self.cell_count[w, i, j] = 0
+
+    @ti.func
+    def insert(self, world: ti.i32, pos: ti.math.vec2, item: ti.i32):
+        cell = self.cell_of(pos)
+        slot = self.cell_start[world, cell.x, cell.y] + ti.atomic_add(self.cell_count[world, cell.x, cell.y], 1)
+        self.items[slot] = item
+        self.item_pos[slot] = pos
+
+    @ti.func
+    def cell_range(self, world: ti.i32, cell_x: ti.i32, cell_y: ti.i32) -> ti.math.ivec2:
+        start = self.cell_start[world, cell_x, cell_y]
+        return ti.math.ivec2(start, start + self.cell_count[world, cell_x, cell_y])
+
+    @ti.func
+    def cells_within(self, pos: ti.math.vec2, radius: ti.f32) -> ti.math.ivec4:
+        # Inclusive (min_x, min_y, max_x, max_y) cell bounds of a square around pos.
+        min_cell = self.cell_of(pos - radius)
+        max_cell = self.cell_of(pos + radius)
+        return ti.math.ivec4(min_cell.x, min_cell.y, max_cell.x, max_cell.y)
+
+    @ti.func
+    def fold_neighbours(self, world: ti.i32, pos: ti.math.vec2, radius: ti.f32, owner: ti.i32,
+                        acc, visit: ti.template()):
+        # Calls acc = visit(acc, world, owner, item, item_pos) for every item in
+        # the cells overlapping the square around pos; visit does the exact
+        # distance test and must skip item == owner itself.
+        cells = self.cells_within(pos, radius)
+        for cell_x in range(cells[0], cells[2] + 1):
+            for cell_y in range(cells[1], cells[3] + 1):
+                span = self.cell_range(world, cell_x, cell_y)
+                for slot in range(span[0], span[1]):
+                    acc = visit(acc, world, owner, self.items[slot], self.item_pos[slot])
+        return acc
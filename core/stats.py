@@ -0,0 +1,114 @@
+import csv
+import os
+import taichi as ti
+
+TRAITS = ("speed", "size", "vision_range", "efficiency", "age", "energy", "generation")
+
+
+# Per-world population statistics reduced on the device: count, mean,
+# variance, min/max and a histogram over [min, max] for every trait. Only
+# these small result fields are copied back, never the creature field.
+@ti.data_oriented
+class PopulationStats:
+    def __init__(self, simulation, bins: int = 16):
+        self.simulation = simulation
+        self.bins = bins
+        self.num_worlds = simulation.config.num_worlds
+        self.trait_fields = [getattr(simulation.creatures, trait) for trait in TRAITS]
+
+        shape = (self.num_worlds, len(TRAITS))
+        self.count = ti.field(dtype=ti.i32, shape=self.num_worlds)
+        self.sum = ti.field(dtype=ti.f32, shape=shape)
+        self.sq_dev = ti.field(dtype=ti.f32, shape=shape)
+        self.min = ti.field(dtype=ti.f32, shape=shape)
+        self.max = ti.field(dtype=ti.f32, shape=shape)
+        self.histogram = ti.field(dtype=ti.i32, shape=shape + (bins,))
+
+    def collect(self) -> dict:
+        self._reduce()
+        count = self.count.to_numpy()
+        mean = self.sum.to_numpy() / count.clip(min=1)[:, None]
+        return {
+            "count": count,
+            "mean": mean,
+            "var": self.sq_dev.to_numpy() / count.clip(min=1)[:, None],
+            "min": self.min.to_numpy(),
+            "max": self.max.to_numpy(),
+            "histogram": self.histogram.to_numpy(),
+        }
+
+    @ti.kernel
+    def _reduce(self):
+        for w, t in self.sum:
+            self.sum[w, t] = 0.0
+            self.sq_dev[w, t] = 0.0
+            self.min[w, t] = ti.math.inf
+            self.max[w, t] = -ti.math.inf
+        for w, t, b in self.histogram:
+            self.histogram[w, t, b] = 0
+        for w in self.count:
+            self.count[w] = 0
+
+        cur = self.simulation.active_buffer[None]
+
+        for k in range(self.simulation.live_count[cur]):
+            entry = self.simulation._creature_entry(self.simulation.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            self.count[w] += 1
+            for t in ti.static(range(len(TRAITS))):
+                value = ti.cast(self.trait_fields[t][w, i], ti.f32)
+                self.sum[w, t] += value
+                ti.atomic_min(self.min[w, t], value)
+                ti.atomic_max(self.max[w, t], value)
+
+        # Second pass around the mean keeps the variance accurate in f32.
+        for k in range(self.simulation.live_count[cur]):
+            entry = self.simulation._creature_entry(self.simulation.live_ids[cur, k])
+            w, i = entry[0], entry[1]
+            for t in ti.static(range(len(TRAITS))):
+                value = ti.cast(self.trait_fields[t][w, i], ti.f32)
+                deviation = value - self.sum[w, t] / self.count[w]
+                self.sq_dev[w, t] += deviation * deviation
+
+                span = self.max[w, t] - self.min[w, t]
+                b = 0
+                if span > 0:
+                    b = ti.min(ti.cast((value - self.min[w, t]) / span * self.bins, ti.i32), self.bins - 1)
+                self.histogram[w, t, b] += 1
+
+
+# Appends one CSV row per (world, trait) every time a sample is written. An
+# existing file is extended, not replaced, so a resumed run keeps the samples
+# written before its checkpoint; the header is only written to an empty file.
+class StatsWriter:
+    def __init__(self, path: str, bins: int, resume_tick: int = None):
+        # A fresh run starts a new file. A run resumed from a checkpoint at
+        # resume_tick keeps the rows up to that tick and drops any written
+        # after it by the interrupted run.
+        header = ["tick", "world", "trait", "count", "mean", "var", "min", "max"] + [f"bin_{b}" for b in range(bins)]
+        rows = []
+        if resume_tick is not None and os.path.exists(path):
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                if next(reader, header) != header:
+                    raise ValueError(f"{path} was written with different columns; resume with the same --stats-bins")
+                rows = [row for row in reader if int(row[0]) <= resume_tick]
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+        self.writer.writerows(rows)
+
+    def write(self, tick: int, stats: dict):
+        for w in range(len(stats["count"])):
+            count = int(stats["count"][w])
+            for t, trait in enumerate(TRAITS):
+                self.writer.writerow(
+                    [tick, w, trait, count,
+                     f"{stats['mean'][w, t]:.6g}", f"{stats['var'][w, t]:.6g}",
+                     f"{stats['min'][w, t]:.6g}" if count else "", f"{stats['max'][w, t]:.6g}" if count else ""] +
+                    stats["histogram"][w, t].tolist()
+                )
+        self.file.flush()
+
+    def close(self):
+        self.file.close()